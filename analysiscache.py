@@ -0,0 +1,126 @@
+import hashlib
+import os
+import struct
+import zlib
+from array import array
+from collections import namedtuple
+
+# On-disk cache of finished analyses, one small file per (PGN contents, engine version, analysis options).
+# Entries are the raw counter array, zlib compressed. Reading an entry bumps its mtime, and when the
+# cache grows past its size cap the entries that were used least recently are deleted first.
+#
+# Checkpoints live next to the entries, one per (PGN path, engine version, analysis options). Besides the counts
+# they hold the size, game count and content hash the PGN had when it was analyzed, so a PGN that only had games
+# appended since can pick up where its last analysis stopped.
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.chesscellavg_cache')
+DEFAULT_CACHE_SIZE_MB = 64
+CACHE_SUFFIX = '.cca'
+CACHE_MAGIC = b'CCACHE01'
+CACHE_HEADER = struct.Struct('<8sQQ')
+CHECKPOINT_SUFFIX = '.ccp'
+CHECKPOINT_MAGIC = b'CCHECK01'
+CHECKPOINT_HEADER = struct.Struct('<8sQQQQ16s')
+
+Checkpoint = namedtuple('Checkpoint', ['analysis', 'total_games', 'file_size', 'game_count', 'content_hash'])
+
+
+def cache_key(content_hash, engine_version, options):
+    # options holds every setting that changes the counts, in a fixed order
+    text = '|'.join([content_hash, str(engine_version)] + [f"{name}={value}" for name, value in sorted(options.items())])
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def cache_path(cache_dir, key, suffix=CACHE_SUFFIX):
+    return os.path.join(cache_dir, key + suffix)
+
+
+def checkpoint_key(pgn_path, engine_version, options):
+    # Follows a file by its path rather than its contents, which change with every game appended
+    return cache_key(os.path.abspath(pgn_path), engine_version, options)
+
+
+def load_cached_analysis(cache_dir, key):
+    # Returns (analysis, total_games), or None when the entry is missing or unreadable
+    path = cache_path(cache_dir, key)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, total_games, length = CACHE_HEADER.unpack_from(data, 0)
+        if magic != CACHE_MAGIC:
+            return None
+        analysis = array('q')
+        analysis.frombytes(zlib.decompress(data[CACHE_HEADER.size:]))
+        if len(analysis) != length:
+            return None
+        os.utime(path)
+    except (OSError, struct.error, zlib.error, ValueError):
+        return None
+    return analysis, total_games
+
+
+def store_cached_analysis(cache_dir, key, analysis, total_games, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+    data = CACHE_HEADER.pack(CACHE_MAGIC, total_games, len(analysis)) + zlib.compress(analysis.tobytes())
+    write_cache_file(cache_dir, cache_path(cache_dir, key), data, max_size_mb)
+
+
+def load_checkpoint(cache_dir, key):
+    # Returns the Checkpoint, or None when there is none or it is unreadable
+    path = cache_path(cache_dir, key, CHECKPOINT_SUFFIX)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, total_games, length, file_size, game_count, digest = CHECKPOINT_HEADER.unpack_from(data, 0)
+        if magic != CHECKPOINT_MAGIC:
+            return None
+        analysis = array('q')
+        analysis.frombytes(zlib.decompress(data[CHECKPOINT_HEADER.size:]))
+        if len(analysis) != length:
+            return None
+        os.utime(path)
+    except (OSError, struct.error, zlib.error, ValueError):
+        return None
+    return Checkpoint(analysis, total_games, file_size, game_count, digest.hex())
+
+
+def store_checkpoint(cache_dir, key, checkpoint, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+    analysis = checkpoint.analysis
+    data = CHECKPOINT_HEADER.pack(CHECKPOINT_MAGIC, checkpoint.total_games, len(analysis), checkpoint.file_size,
+                                  checkpoint.game_count, bytes.fromhex(checkpoint.content_hash)) + zlib.compress(analysis.tobytes())
+    write_cache_file(cache_dir, cache_path(cache_dir, key, CHECKPOINT_SUFFIX), data, max_size_mb)
+
+
+def write_cache_file(cache_dir, path, data, max_size_mb):
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Write to a temporary name first so a parallel run never reads half an entry
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Could not write analysis cache {path}: {e}")
+        return
+    evict_cache(cache_dir, max_size_mb * 1024 * 1024)
+
+
+def evict_cache(cache_dir, max_bytes):
+    entries = []
+    for name in os.listdir(cache_dir):
+        if name.endswith((CACHE_SUFFIX, CHECKPOINT_SUFFIX)):
+            path = os.path.join(cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,151 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+from itertools import islice
+from time import perf_counter, strftime
+import chesscellavg
+import stageprofile
+from pgnio import build_index
+from randompgn import default_output, write_random_pgn
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, peak memory is left out there
+    resource = None
+
+# Times the stages of the analysis in chesscellavg.py one by one and writes games/sec and peak memory of every
+# PGN file to a JSON file, so runs from before and after a change can be compared.
+
+BUNDLED_FILES = ["myfile.pgn", "GothamChess_wins.pgn", "Hikaru.pgn", "Levy.pgn", "Magnus.pgn", "MagnusCarlsen_wins.pgn",
+                 "hikaru_wins.pgn", "castling.pgn", "enpassant.pgn"]
+# index: building the sidecar index, the rest are the stages of chesscellavg.py --profile (see stageprofile.py)
+STAGES = ["index", "read", "parse", "replay", "threats", "aggregate"]
+RENDER_MODES = ('positions', 'threatened', 'threat')
+RENDER_QUERY = ('piece_type', 'P', 'white')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Chess PGN Processor Benchmark")
+    parser.add_argument('--files', type=str, nargs='*', help='PGN files to benchmark, all bundled PGN files by default.')
+    parser.add_argument('--synthetic', type=int, action='append', default=[], help='Also benchmark a file of this many random games, can be given more than once (e.g. 10000 and 1000000). Generated files are kept and reused.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random games.')
+    parser.add_argument('--max_games', type=int, help='Only benchmark the first games of every file.')
+    parser.add_argument('--render_repeats', type=int, default=20, help='How often every display mode is drawn for the render timing.')
+    parser.add_argument('--trusted_input', action='store_true', help='Benchmark the analysis as chesscellavg.py --trusted_input runs it.')
+    parser.add_argument('--threat_timing', type=str, choices=['ply', 'final'], default=chesscellavg.THREAT_TIMING, help='Benchmark the analysis with this chesscellavg.py --threat_timing.')
+    parser.add_argument('--output', type=str, default='benchmark.json', help='JSON file the results are written to.')
+    return parser.parse_args()
+
+
+def peak_rss_kb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes everywhere else
+    return peak // 1024 if sys.platform == 'darwin' else peak
+
+
+def time_index(file_path):
+    start = perf_counter()
+    with tempfile.TemporaryFile() as out:
+        build_index(file_path, out)
+    return perf_counter() - start
+
+
+def time_analysis(file_path, max_games):
+    # The whole analysis as chesscellavg.py runs it, before any stage is timed
+    start = perf_counter()
+    analysis = chesscellavg.build_analysis(islice(chesscellavg.parse_pgn(file_path), max_games))
+    return perf_counter() - start, analysis
+
+
+def time_stages(file_path, max_games):
+    # The same analysis again with the --profile timers around the functions doing each stage's work
+    chesscellavg.enable_profiling()
+    stageprofile.reset()
+    chesscellavg.build_analysis(islice(chesscellavg.parse_pgn(file_path), max_games))
+    return chesscellavg.total_games, {stage: stageprofile.stats[stage][0] for stage in STAGES[1:]}
+
+
+def time_render(analysis, repeats):
+    # One query sliced out of the analysis and every display mode drawn offscreen, as a headless export does
+    start = perf_counter()
+    for _ in range(repeats):
+        stats = chesscellavg.update_positions(analysis, chesscellavg.query_positions(RENDER_QUERY))
+        for display_mode, data_to_display in zip(RENDER_MODES, stats):
+            chesscellavg.draw_heatmap(data_to_display, display_mode)
+    return (perf_counter() - start) / repeats
+
+
+def rate(games, seconds):
+    return round(games / seconds, 1) if seconds > 0 else None
+
+
+def benchmark_file(file_path, max_games, render_repeats, trusted_input, threat_timing):
+    # Runs in a process of its own, so the peak memory belongs to this file alone
+    chesscellavg.TRUSTED_INPUT = trusted_input
+    chesscellavg.THREAT_TIMING = threat_timing
+    chesscellavg.settings = {"workers": 1, "pgnfile": file_path, "indexed_games": 0, "piece_type": None, "piece_color": None}
+    chesscellavg.load_pygame()
+    chesscellavg.pygame.font.init()
+
+    index_seconds = time_index(file_path)
+    analysis_seconds, analysis = time_analysis(file_path, max_games)
+    games, seconds = time_stages(file_path, max_games)
+    seconds["index"] = index_seconds
+    render_seconds = time_render(analysis, render_repeats)
+
+    print(f"{file_path}: {games} games, {rate(games, analysis_seconds)} games/sec")
+    return {
+        "file": file_path,
+        "size_bytes": os.path.getsize(file_path),
+        "games": games,
+        "stages": {stage: {"seconds": round(seconds[stage], 4), "games_per_second": rate(games, seconds[stage])} for stage in STAGES},
+        "analysis": {"seconds": round(analysis_seconds, 4), "games_per_second": rate(games, analysis_seconds)},
+        "render": {"seconds_per_query": round(render_seconds, 5), "modes": len(RENDER_MODES)},
+        "peak_rss_kb": peak_rss_kb(),
+    }
+
+
+def benchmark_files(file_paths, max_games, render_repeats, trusted_input, threat_timing):
+    import multiprocessing
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for file_path in file_paths:
+        with context.Pool(1) as pool:
+            results.append(pool.apply(benchmark_file, (file_path, max_games, render_repeats, trusted_input, threat_timing)))
+    return results
+
+
+def main():
+    args = parse_arguments()
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    file_paths = args.files if args.files else [os.path.join(base_dir, name) for name in BUNDLED_FILES]
+    for games in args.synthetic:
+        synthetic_path = default_output(games, args.seed)
+        if not os.path.exists(synthetic_path):
+            write_random_pgn(synthetic_path, games, args.seed)
+        file_paths.append(synthetic_path)
+
+    import chess
+    results = {
+        "date": strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "python_chess": chess.__version__,
+        "platform": platform.platform(),
+        "threat_timing": args.threat_timing,
+        "trusted_input": args.trusted_input,
+        "max_games": args.max_games,
+        "files": benchmark_files(file_paths, args.max_games, args.render_repeats, args.trusted_input, args.threat_timing),
+    }
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results saved as {args.output}")
+
+
+if __name__ == "__main__":
+    main()
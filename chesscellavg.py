@@ -1,14 +1,26 @@
-import chess
-import chess.pgn
 import io
-from collections import defaultdict
 import argparse
+import csv
+import json
 import os
-import pygame
 import math
-
-print("\n chesscellavg: --help for more options\n")
-print("\n")
+from array import array
+from functools import partial
+import threading
+from time import monotonic
+from pgnio import appended_since, iter_pgn_file, load_index
+from gamestore import ILLEGAL_MOVE, NO_GAME, StoredGame, is_game_store, iter_store_file, open_store
+from analysiscache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE_MB, Checkpoint, cache_key, checkpoint_key, load_cached_analysis, load_checkpoint, store_cached_analysis, store_checkpoint
+import stageprofile
+
+# pygame and python-chess take longer to import than everything else together, so they are only imported on the
+# paths that need them: pygame by load_pygame() before anything is drawn, python-chess (through origintracking.py)
+# once games are read. --help, cached headless runs and the analysis workers start without them.
+pygame = None
+
+def load_pygame():
+    global pygame
+    import pygame
 
 # Known bugs:
 # Positions seems to not calculate considering pawns get promoted, while threaten situations it does.
@@ -28,15 +40,31 @@ RED = (255, 0, 0)
 GREEN = (0, 255, 0)
 DEFAULT_SIZE = 20  # font size
 
+# How often the heatmap is redrawn from the partial counts while the analysis runs
+PARTIAL_UPDATE_MS = 250
+# Most games in one worker chunk, so progress and the partial heatmap keep moving on big files
+GAMES_PER_CHUNK = 1000
+
 VERBOSE = False
+TRUSTED_INPUT = False
+THREAT_TIMING = 'ply'
+PROFILE = False
+
+# Bump whenever a change to the analysis changes the counts, so older cached results are not reused
+ENGINE_VERSION = 2
 
 board_display = "percent"
 default_filename = "myfile.pgn"
 settings = None
 total_games = 0
 
+# Render caches, fonts by size, the empty board and the last heatmap frame drawn
+fonts = {}
+background_surface = None
+heatmap_cache = None
+
 def parse_arguments():
-    global VERBOSE, screen_height, screen_width, board_size, square_size, board_display
+    global VERBOSE, TRUSTED_INPUT, THREAT_TIMING, screen_height, screen_width, board_size, square_size, board_display
 
     parser = argparse.ArgumentParser(description="Chess PGN Processor")
 
@@ -50,6 +78,20 @@ def parse_arguments():
     parser.add_argument('--piece_color', type=str, help='Color of the piece to search for (white or black). Required for piece type search mode')
     parser.add_argument('--timeout', type=int, default=-1, help='Timeout in seconds. Default is -1, meaning no timeout.')
     parser.add_argument('--board_display', type=str, default=board_display, help='Show board positions in (percent) or (totals)')
+    parser.add_argument('--trusted_input', action='store_true', help='Skip the extra legality check of every move, python-chess already checks them while reading the PGN.')
+    parser.add_argument('--validate_only', action='store_true', help='Only check every game in the PGN file for unreadable or illegal moves and report them.')
+    parser.add_argument('--threat_timing', type=str, choices=['ply', 'final'], default=THREAT_TIMING, help='Count threats at every ply of the game (ply) or only on the final board for every square visited (final).')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to analyze games with. Default is 1.')
+    parser.add_argument('--cache_dir', type=str, default=DEFAULT_CACHE_DIR, help='Folder for cached analysis results.')
+    parser.add_argument('--cache_size', type=int, default=DEFAULT_CACHE_SIZE_MB, help='Size cap of the analysis cache in MB, least recently used results are removed first.')
+    parser.add_argument('--no_cache', action='store_true', help='Always analyze the PGN file again instead of using cached results.')
+    parser.add_argument('--headless', action='store_true', help='Run the --search_mode query without opening a window, save the heatmaps as PNG and the counts as CSV and JSON, then exit.')
+    parser.add_argument('--output', type=str, help='Base path of the --headless output files. Default is the PGN file path without .pgn.')
+    parser.add_argument('--profile', action='store_true', help='Time the read, parse, replay, threats, aggregate and render stages and print a summary at exit.')
+    parser.add_argument('--profile_dump', type=str, help='Run under cProfile and save the stats to this file (main process only).')
+    parser.add_argument('--profile_memory', type=str, help='Trace memory allocations, print the peak and the largest allocations at exit and save the snapshot to this file (main process only).')
+    parser.add_argument('--batch', type=str, help='File with one query per line ("Q white" for a piece type and color, "e2" for a starting position). Runs headless, the games are read once for all queries.')
+    parser.add_argument('--query', type=str, action='append', help='A query like --batch lines ("Q white" or e2), can be given several times. Runs headless.')
     args = parser.parse_args()
 
     if '--help' in vars(args):
@@ -57,6 +99,8 @@ def parse_arguments():
         return
 
     VERBOSE = args.verbose
+    TRUSTED_INPUT = args.trusted_input
+    THREAT_TIMING = args.threat_timing
     screen_width = args.screen_width
     screen_height = args.screen_height
     board_size = min(screen_width, screen_height)
@@ -65,9 +109,6 @@ def parse_arguments():
 
     return vars(args)
 
-# Initialize pygame
-pygame.init()
-
 
 
 # Initial positions for white and black pieces
@@ -90,24 +131,57 @@ black_piece_type = [
 ]
 
 
-def initialize_positions():
-    return [
-        ["a1"], ["b1"], ["c1"], ["d1"],
-        ["e1"], ["f1"], ["g1"], ["h1"],
-        ["a2"], ["b2"], ["c2"], ["d2"],
-        ["e2"], ["f2"], ["g2"], ["h2"],
-        ["a7"], ["b7"], ["c7"], ["d7"],
-        ["e7"], ["f7"], ["g7"], ["h7"],
-        ["a8"], ["b8"], ["c8"], ["d8"],
-        ["e8"], ["f8"], ["g8"], ["h8"]
-    ]
+class BoardCounter:
+    # Counts per board square, indexed by python-chess square numbers (a1=0 ... h8=63)
+    def __init__(self, counts=None):
+        self.counts = array('q', counts if counts is not None else bytes(8 * 64))
 
+    def __getitem__(self, square):
+        return self.counts[square]
 
+    def __bool__(self):
+        return any(self.counts)
 
-def chess_notation_to_indices(notation):
-    file = ord(notation[0]) - ord('a') + 1
-    rank = int(notation[1])
-    return (file, rank)
+    def add_counts(self, counts, offset=0):
+        # Adds 64 counts starting at offset, e.g. one origin's slice of the analysis
+        own = self.counts
+        for square in range(64):
+            count = counts[offset + square]
+            if count:
+                own[square] += count
+
+    def items(self):
+        # Only squares with a count, empty squares are neither drawn nor part of the min/max
+        return [(square, count) for square, count in enumerate(self.counts) if count]
+
+    def values(self):
+        return [count for count in self.counts if count]
+
+    def normalize(self, display_mode):
+        # Heatmap scale of the finished counts: the top count, the lowest count and the circle intensity of every
+        # square. Worked out once per dataset, so drawing a heatmap only looks them up.
+        values = self.values()
+        self.true_max = max(values, default=1)
+        self.true_min = min(values, default=0)
+        self.intensities = array('B', bytes(64))
+
+        if display_mode == 'positions':
+            # Scaled against the top count once a lone top square far above the others is left out
+            threshold = self.true_max * 0.004
+            filtered_values = [v for v in values if abs(v - self.true_max) > threshold]
+            max_count = max(filtered_values, default=self.true_max) if filtered_values else self.true_max
+
+        for square, count in self.items():
+            if display_mode == 'positions':
+                intensity = int((count / max_count) * 255)
+            else:
+                # For threatened and threatening positions, use a power function for more distinction
+                if self.true_max > self.true_min:
+                    normalized_value = (count - self.true_min) / (self.true_max - self.true_min)
+                    intensity = int(((normalized_value ** 0.5) * 200) + 55)  # Apply square root and scale
+                else:
+                    intensity = 255 if count > 0 else 55
+            self.intensities[square] = max(55, min(intensity, 255))  # Ensure intensity is between 55 and 255
 
 def save_screenshot(screen, file_path):
     base_filename, _ = os.path.splitext(file_path)
@@ -119,14 +193,57 @@ def save_screenshot(screen, file_path):
     pygame.image.save(screen, file_name)
     print(f"Screenshot saved as {file_name}")
 
+def get_font(size):
+    # SysFont looks the font file up and loads it again on every call
+    if size not in fonts:
+        fonts[size] = pygame.font.SysFont("Arial", size)
+    return fonts[size]
+
+def export_results(starting_positions, position_stats, threatened_stats, threat_stats, output_base):
+    # Draws every display mode on an offscreen surface, so no window or display driver is needed
+    surface = pygame.Surface((screen_width, screen_height))
+    for display_mode, name in (('positions', 'positions'), ('threatened', 'threatened'), ('threat', 'threatening')):
+        render_counts(surface, position_stats, threatened_stats, threat_stats, display_mode)
+        pygame.image.save(surface, f"{output_base}_{name}.png")
+        print(f"Heatmap saved as {output_base}_{name}.png")
+
+    squares = [(SQUARE_NAMES[square], position_stats[square], threatened_stats[square], threat_stats[square]) for square in range(64)]
+    with open(f"{output_base}.csv", 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['square', 'positions', 'threatened', 'threatening'])
+        writer.writerows(squares)
+    print(f"Counts saved as {output_base}.csv")
+
+    # Described from the query's own starting squares, settings still hold whatever the previous query set
+    piece_type, piece_color = describe_positions(starting_positions)
+    results = {
+        "pgnfile": settings["pgnfile"],
+        "piece_type": piece_type,
+        "piece_color": piece_color,
+        "starting_positions": starting_positions,
+        "total_games": total_games,
+        "games_in_file": settings["indexed_games"],
+        "threat_timing": THREAT_TIMING,
+        "squares": {name: {"positions": positions, "threatened": threatened, "threatening": threatening} for name, positions, threatened, threatening in squares},
+    }
+    with open(f"{output_base}.json", 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Counts saved as {output_base}.json")
+
 def draw_board(screen):
-    for row in range(8):
-        for col in range(8):
-            color = LBLUE if (row + col) % 2 == 0 else DBLUE
-            pygame.draw.rect(screen, color, (col * square_size, row * square_size, square_size, square_size))
+    # The squares and the side panel background never change, so they are drawn once and blitted after that
+    global background_surface
+    if background_surface is None:
+        background_surface = pygame.Surface((screen_width, screen_height))
+        background_surface.fill(LBLUE)
+        for row in range(8):
+            for col in range(8):
+                color = LBLUE if (row + col) % 2 == 0 else DBLUE
+                pygame.draw.rect(background_surface, color, (col * square_size, row * square_size, square_size, square_size))
+    screen.blit(background_surface, (0, 0))
 
 def render_text(screen, text, position, color, size=DEFAULT_SIZE, update_screen_immediately=False, center=False):
-    font = pygame.font.SysFont("Arial", size)
+    font = get_font(size)
     text_surface = font.render(text, True, color)
     text_rect = text_surface.get_rect()
 
@@ -145,9 +262,8 @@ def render_text(screen, text, position, color, size=DEFAULT_SIZE, update_screen_
         pygame.display.flip()
 
 def render_counts(screen, total_positions_seen, total_threatened_positions, total_threat_positions, display_mode):
-    global board_display, total_games, settings
-    surface = pygame.Surface((screen_width, screen_height), pygame.SRCALPHA)
-
+    # The whole frame is kept until the counters, the display mode or the game count change
+    global heatmap_cache
     if display_mode == 'positions':
         data_to_display = total_positions_seen
     elif display_mode == 'threatened':
@@ -155,29 +271,25 @@ def render_counts(screen, total_positions_seen, total_threatened_positions, tota
     else:
         data_to_display = total_threat_positions
 
-    true_max = max(data_to_display.values(), default=1)
-    true_min = min(data_to_display.values(), default=0)
+    key = (display_mode, total_games)
+    if heatmap_cache is None or heatmap_cache[0] is not data_to_display or heatmap_cache[1] != key:
+        heatmap_cache = (data_to_display, key, draw_heatmap(data_to_display, display_mode))
+    screen.blit(heatmap_cache[2], (0, 0))
 
-    font = pygame.font.SysFont("Arial", 16)
+def draw_heatmap(data_to_display, display_mode):
+    global board_display, total_games, settings
+    frame = pygame.Surface((screen_width, screen_height))
+    draw_board(frame)
+    surface = pygame.Surface((screen_width, screen_height), pygame.SRCALPHA)
 
-    for coord, count in data_to_display.items():
-        x, y = map(int, coord.split(','))
-        y = 9 - y
-        
-        if display_mode == 'positions':
-            threshold = true_max * 0.004
-            filtered_values = [v for v in data_to_display.values() if abs(v - true_max) > threshold]
-            max_count = max(filtered_values, default=true_max) if filtered_values else true_max
-            intensity = int((count / max_count) * 255)
-        else:
-            # For threatened and threatening positions, use a power function for more distinction
-            if true_max > true_min:
-                normalized_value = (count - true_min) / (true_max - true_min)
-                intensity = int(((normalized_value ** 0.5) * 200) + 55)  # Apply square root and scale
-            else:
-                intensity = 255 if count > 0 else 55
-        
-        intensity = max(55, min(intensity, 255))  # Ensure intensity is between 55 and 255
+    true_max = data_to_display.true_max
+
+    font = get_font(16)
+
+    for square, count in data_to_display.items():
+        x = square % 8 + 1
+        y = 8 - square // 8
+        intensity = data_to_display.intensities[square]
         
         radius = square_size // 4
         if display_mode == 'positions':
@@ -198,189 +310,363 @@ def render_counts(screen, total_positions_seen, total_threatened_positions, tota
         text_rect = count_text.get_rect(center=circle_center)
         surface.blit(count_text, text_rect)
     
-    screen.blit(surface, (0, 0))
-    
-    
-    screen.blit(surface, (0, 0))
+    # Blitted twice, which is what gives the circles their depth of color
+    frame.blit(surface, (0, 0))
+    frame.blit(surface, (0, 0))
     
     if settings["piece_type"] is not None:
-        render_text(screen, "Tracking " + settings["piece_type"], (square_size * 8 + 5, 0), WHITE, 16)
-    render_text(screen, "↑" + str(true_max), (square_size * 8 + 5, 20) , WHITE, 16)
-    render_text(screen, "Top square's total!", (square_size * 8 + 5, 40) , WHITE, 16)
-    render_text(screen, "(All %'s are based on the total)", (square_size * 8 + 5, 60) , WHITE, 12)
-    # render_text(screen, "Promotions still considered pawns", (square_size * 8 + 5, 80) , WHITE, 12)
-    render_text(screen, "More options in commandline!", (square_size * 8 + 5, 100) , WHITE, 12)
-    render_text(screen, settings["pgnfile"], (square_size * 8 + 5, 120) , WHITE, 12)
-    render_text(screen, settings["piece_color"], (square_size * 8 + 5, 140) , WHITE, 12)
-    render_text(screen, "Total games: " + str(total_games), (square_size * 8 + 5, 160) , WHITE, 12)
+        render_text(frame, "Tracking " + settings["piece_type"], (square_size * 8 + 5, 0), WHITE, 16)
+    render_text(frame, "↑" + str(true_max), (square_size * 8 + 5, 20) , WHITE, 16)
+    render_text(frame, "Top square's total!", (square_size * 8 + 5, 40) , WHITE, 16)
+    render_text(frame, "(All %'s are based on the total)", (square_size * 8 + 5, 60) , WHITE, 12)
+    # render_text(frame, "Promotions still considered pawns", (square_size * 8 + 5, 80) , WHITE, 12)
+    render_text(frame, "More options in commandline!", (square_size * 8 + 5, 100) , WHITE, 12)
+    render_text(frame, settings["pgnfile"], (square_size * 8 + 5, 120) , WHITE, 12)
+    render_text(frame, settings["piece_color"], (square_size * 8 + 5, 140) , WHITE, 12)
+    render_text(frame, "Total games: " + str(total_games), (square_size * 8 + 5, 160) , WHITE, 12)
+    render_text(frame, "Games in file: " + str(settings["indexed_games"]), (square_size * 8 + 5, 200) , WHITE, 12)
     if display_mode == 'positions':
-        render_text(screen, "Displaying: Positions", (square_size * 8 + 5, 180), WHITE, 12)
+        render_text(frame, "Displaying: Positions", (square_size * 8 + 5, 180), WHITE, 12)
     elif display_mode == 'threatened':
-        render_text(screen, "Displaying: Threatened at", (square_size * 8 + 5, 180), WHITE, 12)
+        render_text(frame, "Displaying: Threatened at", (square_size * 8 + 5, 180), WHITE, 12)
     else:
-        render_text(screen, "Displaying: Threatening", (square_size * 8 + 5, 180), WHITE, 12)
+        render_text(frame, "Displaying: Threatening", (square_size * 8 + 5, 180), WHITE, 12)
 
-    render_text(screen, "T=Toggle Positions, Threatened at,", (square_size * 8 + 5, screen_height - 180), WHITE, 12)
-    render_text(screen, "Threatening opponent", (square_size * 8 + 5, screen_height - 150), WHITE, 12)
+    render_text(frame, "T=Toggle Positions, Threatened at,", (square_size * 8 + 5, screen_height - 180), WHITE, 12)
+    render_text(frame, "Threatening opponent", (square_size * 8 + 5, screen_height - 150), WHITE, 12)
     
-    render_text(screen, "ESC=Exit", (square_size * 8 + 5, screen_height - 120), WHITE, 12)
-    render_text(screen, "PRTSCRN screenshot path_1.png", (square_size * 8 + 5, screen_height - 90), WHITE, 12)
-    render_text(screen, "ENTER=New Query", (square_size * 8 + 5, screen_height - 60), WHITE, 12)
+    render_text(frame, "ESC=Exit", (square_size * 8 + 5, screen_height - 120), WHITE, 12)
+    render_text(frame, "PRTSCRN screenshot path_1.png", (square_size * 8 + 5, screen_height - 90), WHITE, 12)
+    render_text(frame, "ENTER=New Query", (square_size * 8 + 5, screen_height - 60), WHITE, 12)
+    return frame
+
+def render_progress(screen, job):
+    # Kept along the bottom of the board, the heatmap of the games read so far is drawn above it
+    fraction, games_per_second, seconds_left = job.progress()
+    time_left = "estimating time left" if seconds_left is None else f"{int(seconds_left)}s left"
+    render_text(screen, f"Calculating... {job.games_read} / {job.games_in_file} games, {games_per_second:.0f} games/s, {time_left}", (10, screen_height - 70), WHITE, 16)
+
+    bar = pygame.Rect(10, screen_height - 45, board_size - 20, 16)
+    pygame.draw.rect(screen, BLACK, bar)
+    pygame.draw.rect(screen, GREEN, (bar.x, bar.y, int(bar.width * fraction), bar.height))
+    pygame.draw.rect(screen, WHITE, bar, 1)
+    render_text(screen, "ESC=Cancel", (10, screen_height - 25), WHITE, 12)
     
 
-import chess
-import chess.pgn
-import io
-from collections import defaultdict
-
-def process_single_game(game_data, starting_positions, total_positions_seen, total_threatened_positions, total_threat_positions, xy_coords):
+def process_single_game(game_data, analysis):
     global total_games
-    positions = initialize_positions()
-    positions_seen = defaultdict(int)
-    threatened_positions = defaultdict(int)
-    threat_positions = defaultdict(int)
-
-    if isinstance(game_data, str):
-        game_stream = io.StringIO(game_data)
-        game = chess.pgn.read_game(game_stream)
-    elif isinstance(game_data, chess.pgn.Game):
-        game = game_data
+    import chess
+    import chess.pgn
+    from origintracking import OriginTracker, TrackingVisitor
+
+    if isinstance(game_data, StoredGame):
+        # Moves from a game store (gamestore.py) were read and checked when the store was written, so they are
+        # pushed as they are, without any SAN to parse
+        if game_data.flags & (NO_GAME | ILLEGAL_MOVE):
+            print("No moves or game found! Processing next game." if game_data.flags & NO_GAME else "Illegal move found. Skipping the game.")
+            return False
+        board = chess.Board(game_data.fen or chess.STARTING_FEN, chess960=game_data.chess960)
+        tracker = OriginTracker()
+        ply_threats = THREAT_TIMING == 'ply'
+        for encoded in game_data.moves:
+            move = chess.Move(encoded & 63, encoded >> 6 & 63, encoded >> 12 or None)
+            tracker.track_move(board, move)
+            board.push(move)
+            if ply_threats:
+                tracker.track_threats(board)
+    elif isinstance(game_data, str) and TRUSTED_INPUT:
+        visitor = chess.pgn.read_game(io.StringIO(game_data), Visitor=partial(TrackingVisitor, THREAT_TIMING == 'ply', VERBOSE))
+        if visitor is None or visitor.board is None:
+            print("No moves or game found! Processing next game.")
+            return False
+        if visitor.illegal_move is not None:
+            print(f"Illegal move found: {visitor.illegal_move}. Skipping the rest of the game.")
+            return False
+        board = visitor.board
+        tracker = visitor.tracker
     else:
-        raise ValueError("Invalid game_data format. Expected str or chess.pgn.Game.")
+        if isinstance(game_data, str):
+            game_stream = io.StringIO(game_data)
+            game = chess.pgn.read_game(game_stream)
+        elif isinstance(game_data, chess.pgn.Game):
+            game = game_data
+        else:
+            raise ValueError("Invalid game_data format. Expected str or chess.pgn.Game.")
 
-    game_moves = game.mainline_moves()
+        game_moves = game.mainline_moves()
 
-    if game_moves is None or game is None:
-        print("No moves or game found! Processing next game.")
-        return
+        if game_moves is None or game is None:
+            print("No moves or game found! Processing next game.")
+            return False
 
-    board = game.board()
-    positions_found = False
-    for move in game_moves:
-        from_square = chess.SQUARE_NAMES[move.from_square]
-        to_square = chess.SQUARE_NAMES[move.to_square]
-
-        # Update positions and handle special moves (castling, en passant)
-        for path in positions:
-            if path[-1] == to_square:
-                path.append('x')
-            if path[-1] == from_square:
-                path.append(to_square)
-                positions_found = True
-
-        # Handle castling
-        if board.is_castling(move):
-            if to_square == 'g1':
-                for path in positions:
-                    if path[-1] == 'h1':
-                        path.append('f1')
-            elif to_square == 'c1':
-                for path in positions:
-                    if path[-1] == 'a1':
-                        path.append('d1')
-            elif to_square == 'g8':
-                for path in positions:
-                    if path[-1] == 'h8':
-                        path.append('f8')
-            elif to_square == 'c8':
-                for path in positions:
-                    if path[-1] == 'a8':
-                        path.append('d8')
-
-        # Push the move only if it is legal
-        if move in board.legal_moves:
-            board.push(move)
-        else:
-            print(f"Illegal move found: {move}. Skipping the rest of the game.")
-            return
+        board = game.board()
+        tracker = OriginTracker()
+        for move in game_moves:
+            tracker.track_move(board, move)
 
-    if not positions_found:
+            # Push the move only if it is legal
+            if move and (TRUSTED_INPUT or move in board.legal_moves):
+                board.push(move)
+                if THREAT_TIMING == 'ply':
+                    tracker.track_threats(board)
+            else:
+                print(f"Illegal move found: {move}. Skipping the rest of the game.")
+                return False
+
+    if not tracker.positions_found:
         print("No positions found in game! Processing next game.")
-        return
+        return False
 
     total_games += 1
+    count_game(tracker, board, analysis)
+    return True
+
+def count_game(tracker, board, analysis):
+    # Adds a replayed game's visits and threats to the analysis, board is the board after the last move
+    from origintracking import final_board_threats
+
+    # Count positions. Every origin is counted, a query later picks the origins it wants out of the analysis.
+    for key, visit_count in tracker.visits.items():
+        origin, piece_square = divmod(key, 64)
+        analysis[analysis_offset(origin, POSITIONS) + piece_square] += visit_count
+
+    if THREAT_TIMING == 'ply':
+        for key, count in tracker.threatened.items():
+            origin, square = divmod(key, 64)
+            analysis[analysis_offset(origin, THREATENED) + square] += count
+        for key, count in tracker.threatening.items():
+            origin, square = divmod(key, 64)
+            analysis[analysis_offset(origin, THREATENING) + square] += count
+        return
 
-    # Count positions
-    for path in positions:
-        if path[0] in starting_positions:
-            for pos in path:
-                if pos != 'x':
-                    if xy_coords:
-                        x, y = chess_notation_to_indices(pos)
-                        coord_str = f"{x},{y}"
-                    else:
-                        coord_str = pos
-                    positions_seen[coord_str] += 1
-                    
-                    # Since we just found a new position, this is an opportune time to calculate its threatened positions
-                    piece_square = chess.parse_square(pos)
-                    if piece_square is not None and board.piece_type_at(piece_square) is not None:
-                        piece_color = board.color_at(piece_square)
-                        piece_type = board.piece_type_at(piece_square)
-                        if VERBOSE:
-                            print(f"Piece at {pos}: {chess.PIECE_NAMES[piece_type]} ({chess.COLOR_NAMES[piece_color]})")
-                        
-                        # threatened by opponent
-                        for square in chess.SQUARES:
-                            if board.piece_type_at(square) is not None:
-                                if board.color_at(square) != piece_color:
-                                    if board.is_attacked_by(board.color_at(square), piece_square):
-                                        threatened_square = chess.SQUARE_NAMES[piece_square]
-                                        if xy_coords:
-                                            x, y = chess_notation_to_indices(threatened_square)
-                                            threatened_coord = f"{x},{y}"
-                                        else:
-                                            threatened_coord = threatened_square
-                                        threatened_positions[threatened_coord] += 1
-                                        if VERBOSE:
-                                            print(f"Position {threatened_coord} is threatened by opponent")
-                        
-                        # threatening opponent
-                        for square in chess.SQUARES:
-                            if board.is_attacked_by(piece_color, square):
-                                if board.piece_type_at(square) is not None and board.color_at(square) != piece_color:
-                                    threatened_square = chess.SQUARE_NAMES[square]
-                                    if xy_coords:
-                                        x, y = chess_notation_to_indices(threatened_square)
-                                        threat_coord = f"{x},{y}"
-                                    else:
-                                        threat_coord = threatened_square
-                                    threat_positions[threat_coord] += 1
-                                    if VERBOSE:
-                                        print(f"Position {threat_coord} is threatened by {chess.PIECE_NAMES[piece_type]}")
-    if VERBOSE:
-        print("Final threatened positions:", threatened_positions)
-        print("Final threat positions:", threat_positions)
-
-    # Aggregate counts
-    for coord, count in positions_seen.items():
-        total_positions_seen[coord] += count
-    for coord, count in threatened_positions.items():
-        total_threatened_positions[coord] += count
-    for coord, count in threat_positions.items():
-        total_threat_positions[coord] += count
-
-
-def update_positions(games, starting_positions, xy_coords):
+    # Final board threats: counted against the board after the last move for every visit of every square.
+    # The threat counts only depend on the final board and the color of the piece standing on the square,
+    # so they are worked out once per square (and color) from the attack bitboards and reused for every visit.
+    threats_by_square = {}
+    threatening_by_color = {}
+    for key, visit_count in tracker.visits.items():
+        origin, piece_square = divmod(key, 64)
+        if piece_square not in threats_by_square:
+            threats_by_square[piece_square] = final_board_threats(board, piece_square, threatening_by_color, VERBOSE)
+        threats = threats_by_square[piece_square]
+        if threats is None:
+            continue
+        threatened_count, threatening_squares = threats
+        if threatened_count:
+            analysis[analysis_offset(origin, THREATENED) + piece_square] += threatened_count * visit_count
+        threat_offset = analysis_offset(origin, THREATENING)
+        for square in threatening_squares:
+            analysis[threat_offset + square] += visit_count
+
+# The analysis of a PGN file is one flat array holding positions, threatened and threatening counts
+# for every square (64) of every metric (3) of every starting square (32), laid out origin by origin.
+# Square names in python-chess square order (a1=0 ... h8=63)
+SQUARE_NAMES = [file + rank for rank in "12345678" for file in "abcdefgh"]
+# The starting squares in the order of ORIGIN_SQUARES in origintracking.py, a1-h2 and a7-h8
+ORIGINS = SQUARE_NAMES[:16] + SQUARE_NAMES[48:]
+POSITIONS = 0
+THREATENED = 1
+THREATENING = 2
+METRICS = 3
+
+def new_analysis():
+    return array('q', bytes(8 * len(ORIGINS) * METRICS * 64))
+
+def analysis_offset(origin, metric):
+    return (origin * METRICS + metric) * 64
+
+def merge_analysis(total, analysis):
+    for i, count in enumerate(analysis):
+        if count:
+            total[i] += count
+
+def build_analysis(games, job=None, resume=None):
+    # Replays every game once and counts all 32 starting pieces at the same time
+    # games is either an iterable of games or the path of a PGN file, which can be split across worker processes
+    # With a job, progress is reported to it and None is returned once it is cancelled
+    # resume is the (analysis, total games, games done) of a checkpoint of a PGN file, only the games after it are read
+    global total_games
+    analysis, total_games, start = resume if resume is not None else (new_analysis(), 0, 0)
+    if job is not None:
+        job.partial = analysis
+        # Only the games after the checkpoint are left to read
+        job.games_in_file = max(job.games_in_file - start, 0)
+    workers = settings.get("workers", 1)
+    if isinstance(games, str) and workers > 1:
+        return build_analysis_in_workers(games, workers, job, analysis, start)
+
+    if isinstance(games, str):
+        games = parse_pgn(games) if start == 0 else iter_games_from(games, start)
+    if PROFILE:
+        games = stageprofile.timed_iter('read', games)
+    for game_data in games:
+        if job is not None:
+            if job.cancelled.is_set():
+                return None
+            job.games_read += 1
+        process_single_game(game_data, analysis)
+    return analysis
+
+def analysis_options():
+    # Settings that change the counts of an analysis, part of the cache key
+    return {"trusted_input": TRUSTED_INPUT, "threat_timing": THREAT_TIMING}
+
+def load_analysis(file_path, job=None):
+    # Reuses the cached analysis of an unchanged PGN file, otherwise builds and caches it. A PGN file that only
+    # had games appended since its last analysis carries on from that analysis' checkpoint.
+    global total_games
+    if settings.get("no_cache", True):
+        return build_analysis(file_path, job)
+
+    index = open_games(file_path)
+    key = cache_key(index.content_hash, ENGINE_VERSION, analysis_options())
+    cached = load_cached_analysis(settings["cache_dir"], key)
+    if cached is not None:
+        index.close()
+        analysis, total_games = cached
+        return analysis
+
+    # Game stores are written in one go, only PGN files grow
+    checkpointed = not is_game_store(file_path)
+    resume = None
+    if checkpointed:
+        progress_key = checkpoint_key(file_path, ENGINE_VERSION, analysis_options())
+        file_state = (index.file_size, len(index), index.content_hash)
+        checkpoint = load_checkpoint(settings["cache_dir"], progress_key)
+        if checkpoint is not None:
+            start = appended_since(index, checkpoint.file_size, checkpoint.game_count, checkpoint.content_hash)
+            if start is None:
+                print(f"{file_path} changed since it was last analyzed, analyzing all of it again.")
+            else:
+                print(f"{file_path} has {len(index) - start} new games since it was last analyzed, analyzing only those.")
+                resume = (checkpoint.analysis, checkpoint.total_games, start)
+    index.close()
+
+    analysis = build_analysis(file_path, job, resume)
+    if analysis is None:
+        return None
+    store_cached_analysis(settings["cache_dir"], key, analysis, total_games, settings["cache_size"])
+    if checkpointed:
+        store_checkpoint(settings["cache_dir"], progress_key, Checkpoint(analysis, total_games, *file_state), settings["cache_size"])
+    return analysis
+
+def analyze_game_range(task):
+    # Runs in a worker process, counts one contiguous range of games from the index
+    global total_games, VERBOSE, TRUSTED_INPUT, THREAT_TIMING
+    file_path, start, stop, VERBOSE, TRUSTED_INPUT, THREAT_TIMING, profile = task
+    total_games = 0
+    analysis = new_analysis()
+    if profile:
+        enable_profiling()
+        stageprofile.reset()
+
+    index = open_games(file_path)
+    try:
+        games = index.iter_games(start, stop)
+        if profile:
+            games = stageprofile.timed_iter('read', games)
+        for game_data in games:
+            process_single_game(game_data, analysis)
+    finally:
+        index.close()
+
+    return analysis, total_games, stageprofile.stats if profile else None
+
+def build_analysis_in_workers(file_path, workers, job, analysis, start):
+    # Adds the games from start on to analysis
+    global total_games
+    import multiprocessing
+    index = open_games(file_path)
+    # A few chunks per worker so one slow chunk doesn't leave the other cores idle
+    ranges = index.chunks(max(workers * 4, (len(index) - start) // GAMES_PER_CHUNK), start)
+    index.close()
+
+    tasks = [(file_path, start, stop, VERBOSE, TRUSTED_INPUT, THREAT_TIMING, PROFILE) for start, stop in ranges]
+    # Spawned rather than forked, a forked copy of the pygame/SDL state can hang the workers
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        # imap hands the results back in chunk order, so merging gives the same totals as a serial run
+        results = pool.imap(analyze_game_range, tasks)
+        for start, stop in ranges:
+            result = None
+            while result is None:
+                try:
+                    result = results.next(timeout=0.1)
+                except multiprocessing.TimeoutError:
+                    if job is not None and job.cancelled.is_set():
+                        # Leaving the with block terminates the workers still running
+                        return None
+            chunk_analysis, games_counted, chunk_profile = result
+            if job is not None:
+                job.games_read += stop - start
+            if chunk_profile is not None:
+                stageprofile.merge(chunk_profile)
+            merge_analysis(analysis, chunk_analysis)
+            total_games += games_counted
+    return analysis
+
+class AnalysisJob:
+    # Builds the analysis of a PGN file on a background thread so the window keeps responding while it runs.
+    # The UI polls it every frame, cancel() stops it before the next game (or chunk of games with --workers).
+    def __init__(self, file_path, games_in_file):
+        self.games_in_file = games_in_file
+        self.games_read = 0
+        self.analysis = None
+        # The counts so far while games are still being read, merged chunk by chunk with --workers
+        self.partial = None
+        self.cancelled = threading.Event()
+        self.started = monotonic()
+        self.thread = threading.Thread(target=self.run, args=(file_path,), daemon=True)
+        self.thread.start()
+
+    def run(self, file_path):
+        try:
+            self.analysis = stageprofile.profiled(load_analysis, file_path, self)
+        except Exception as e:
+            print(f"Analysis of {file_path} failed: {e}")
+
+    def cancel(self):
+        self.cancelled.set()
+
+    def finished(self):
+        return not self.thread.is_alive()
+
+    def progress(self):
+        # Fraction of the file's games read, games per second and estimated seconds left (None until known)
+        elapsed = monotonic() - self.started
+        games_per_second = self.games_read / elapsed if elapsed > 0 else 0
+        fraction = min(self.games_read / self.games_in_file, 1) if self.games_in_file else 0
+        seconds_left = max(self.games_in_file - self.games_read, 0) / games_per_second if games_per_second else None
+        return fraction, games_per_second, seconds_left
+
+def update_positions(analysis, starting_positions):
+    # Sums the counts of the given starting squares, no games are replayed here
     global settings
-    total_positions_seen = defaultdict(int)
-    total_threatened_positions = defaultdict(int)
-    total_threat_positions = defaultdict(int)
+    total_positions_seen = BoardCounter()
+    total_threatened_positions = BoardCounter()
+    total_threat_positions = BoardCounter()
+
+    piece_type, settings["piece_color"] = describe_positions(starting_positions)
+    if piece_type is not None:
+        settings["piece_type"] = piece_type
+
+    for origin, origin_square in enumerate(ORIGINS):
+        if origin_square not in starting_positions:
+            continue
+        for metric, totals in ((POSITIONS, total_positions_seen), (THREATENED, total_threatened_positions), (THREATENING, total_threat_positions)):
+            totals.add_counts(analysis, analysis_offset(origin, metric))
+
+    total_positions_seen.normalize('positions')
+    total_threatened_positions.normalize('threatened')
+    total_threat_positions.normalize('threat')
+    return total_positions_seen, total_threatened_positions, total_threat_positions
 
-    settings["piece_color"] = None
+def describe_positions(starting_positions):
+    # Piece type (with the square when there is only one) and color of the pieces starting on the given squares
     for piece_type in white_piece_type + black_piece_type:
         for piece in piece_type[1:]:
             if piece in starting_positions:
-                settings["piece_color"] = "white" if piece_type in white_piece_type else "black"
-                settings["piece_type"] = piece_type[0] + (starting_positions[0] if len(starting_positions) == 1 else "")
-                break
-        if settings["piece_color"]:
-            break
-
-    for game_data in games:
-        process_single_game(game_data, starting_positions, total_positions_seen, total_threatened_positions, total_threat_positions, xy_coords)
-
-    return total_positions_seen, total_threatened_positions, total_threat_positions
+                return piece_type[0] + (starting_positions[0] if len(starting_positions) == 1 else ""), "white" if piece_type in white_piece_type else "black"
+    return None, None
 
 def get_starting_positions_by_piece_type(piece_type, piece_color):
     global settings
@@ -392,31 +678,180 @@ def get_starting_positions_by_piece_type(piece_type, piece_color):
             return piece[1:]
     return []
 
-def analyze_games_by_piece_type(games, piece_type, piece_color, xy_coords):
-    starting_positions = get_starting_positions_by_piece_type(piece_type, piece_color)
+def query_positions(query):
+    # Starting squares a query tracks, query is ('piece_type', piece type, piece color) or ('position', starting square)
+    if query[0] == 'position':
+        starting_position = query[1].lower()
+        if starting_position not in ORIGINS:
+            print(f"No piece starts on {query[1]}, a starting position is one of a1-h2 or a7-h8.")
+            return []
+        return [starting_position]
+    starting_positions = get_starting_positions_by_piece_type(query[1], query[2])
     if not starting_positions:
-        print(f"No starting positions found for piece type {piece_type} and color {piece_color}.")
-        return {}, {}
+        print(f"No starting positions found for piece type {query[1]} and color {query[2]}.")
+    return starting_positions
+
+def validate_pgn(file_path):
+    # Replays every game with full legality checks and reports the games that can't be analyzed
+    import chess.pgn
+    if is_game_store(file_path):
+        print(f"{file_path} is a game store, its games were checked when it was written.")
+        return 0
+    problems = 0
+    games_checked = 0
+    for game_number, game_data in enumerate(parse_pgn(file_path), 1):
+        games_checked += 1
+        game = chess.pgn.read_game(io.StringIO(game_data))
+        if game is None:
+            print(f"Game {game_number}: no game found")
+            problems += 1
+            continue
+
+        description = f"Game {game_number} ({game.headers.get('White', '?')} vs {game.headers.get('Black', '?')})"
+        for error in game.errors:
+            print(f"{description}: {error}")
+            problems += 1
+
+        board = game.board()
+        for move in game.mainline_moves():
+            if move not in board.legal_moves:
+                print(f"{description}: illegal move {move} in {board.fen()}")
+                problems += 1
+                break
+            board.push(move)
 
-    return update_positions(games, starting_positions, xy_coords)
+    print(f"Checked {games_checked} games, found {problems} problems.")
+    return problems
 
 def parse_pgn(file_path):
+    # Streams the games one at a time, call again for every new pass over the file
+    if is_game_store(file_path):
+        return iter_store_file(file_path)
+    return iter_pgn_file(file_path)
+
+def iter_games_from(file_path, start):
+    # The games of a PGN file or game store from game number start on
+    index = open_games(file_path)
+    try:
+        yield from index.iter_games(start)
+    finally:
+        index.close()
+
+def open_games(file_path):
+    # Game count, content hash and worker chunks of a PGN come from its sidecar index, a game store has its own
+    if is_game_store(file_path):
+        return open_store(file_path)
+    return load_index(file_path)
+
+def parse_query(text):
+    # "Q white" is a piece type and color, "e2" a starting position
+    parts = text.split()
+    if len(parts) == 2:
+        return ('piece_type', parts[0], parts[1])
+    if len(parts) == 1:
+        return ('position', parts[0])
+    return None
+
+def read_batch_queries(file_path):
+    # One query per line, blank lines and # comments are skipped
     with open(file_path, 'r') as f:
-        content = f.read()
-    
-    games = content.split('\n[Event ')
-    games = ['[Event ' + game for game in games if game]
+        return [line.split('#')[0].strip() for line in f if line.split('#')[0].strip()]
+
+def headless_queries():
+    # Returns (output name suffix, query) pairs, a single --search_mode query keeps the plain output names
+    texts = (read_batch_queries(settings["batch"]) if settings["batch"] else []) + (settings["query"] or [])
+    if not texts:
+        if settings["search_mode"] == 1 and settings["piece_type"] and settings["piece_color"]:
+            return [("", ('piece_type', settings["piece_type"], settings["piece_color"]))]
+        elif settings["search_mode"] == 2 and settings["starting_position"]:
+            return [("", ('position', settings["starting_position"]))]
+        print("--headless needs --search_mode 1 with --piece_type and --piece_color, or --search_mode 2 with --starting_position.")
+        return []
+
+    queries = []
+    for text in texts:
+        query = parse_query(text)
+        if query is None:
+            print(f"Skipping query '{text}', expected a piece type and color (Q white) or a starting position (e2).")
+            continue
+        queries.append(("_" + "_".join(query[1:]), query))
+    return queries
+
+def run_headless(file_path):
+    queries = headless_queries()
+    if not queries:
+        return
 
-    return games
+    # Every query is a slice of the same analysis, so the games are read once however many queries there are
+    analysis = load_analysis(file_path)
+    # Only the font module, the display is never initialized
+    load_pygame()
+    pygame.font.init()
+    output_base = settings["output"] or os.path.splitext(file_path)[0]
+    for suffix, query in queries:
+        starting_positions = query_positions(query)
+        if not starting_positions:
+            continue
+        position_stats, threatened_stats, threat_stats = update_positions(analysis, starting_positions)
+        export_results(starting_positions, position_stats, threatened_stats, threat_stats, output_base + suffix)
+    pygame.font.quit()
+
+def enable_profiling():
+    # Wraps the function doing each stage's work in a timer, the functions are called through the module so the
+    # timed versions are picked up everywhere. In a worker process this runs once for all of its chunks.
+    global PROFILE, process_single_game, count_game, draw_heatmap
+    if PROFILE:
+        return
+    import chess.pgn
+    import origintracking
+    PROFILE = True
+    chess.pgn.read_game = stageprofile.timed('parse', chess.pgn.read_game)
+    # With --trusted_input the moves are replayed while python-chess parses them, so that replay counts as parse
+    process_single_game = stageprofile.timed('replay', process_single_game)
+    origintracking.OriginTracker.track_threats = stageprofile.timed('threats', origintracking.OriginTracker.track_threats)
+    origintracking.final_board_threats = stageprofile.timed('threats', origintracking.final_board_threats)
+    count_game = stageprofile.timed('aggregate', count_game)
+    draw_heatmap = stageprofile.timed('render', draw_heatmap)
 
 def main():
-    global settings, total_games
+    global settings
     settings = parse_arguments()
-    
+    started = monotonic()
+    stageprofile.start_dumps(settings["profile_dump"], settings["profile_memory"])
+    if settings["profile"]:
+        enable_profiling()
+    try:
+        run()
+    finally:
+        if PROFILE:
+            stageprofile.print_summary(monotonic() - started)
+        stageprofile.finish_dumps(settings["profile_dump"])
+
+def run():
+    global total_games
+
+    print("\n chesscellavg: --help for more options\n")
+    print("\n")
+
     file_path = settings["pgnfile"] or input(f"Enter the path to the PGN file (default={default_filename}): ") or default_filename
     settings["pgnfile"] = file_path
-    games = parse_pgn(file_path)
-    xy_coords = True
+
+    if settings["validate_only"]:
+        validate_pgn(file_path)
+        return
+
+    # The sidecar index gives the game count up front without another pass over the file
+    index = open_games(file_path)
+    settings["indexed_games"] = len(index)
+    index.close()
+
+    if settings["headless"] or settings["batch"] or settings["query"]:
+        run_headless(file_path)
+        return
+
+    # Initialize pygame
+    load_pygame()
+    pygame.init()
 
     screen = pygame.display.set_mode((screen_width, screen_height))
     pygame.display.set_caption("Chessboard Position and Threat Frequency")
@@ -430,34 +865,74 @@ def main():
     piece_type = ""
     piece_color = ""
     starting_position = ""
-    position_stats = {}
-    threatened_stats = {}
-    threat_stats = {}
+    position_stats = None
+    threatened_stats = None
+    threat_stats = None
+    # Counts for every starting piece, built in the background by the first query and sliced by every query after it
+    analysis = None
+    job = None
+    tracked_positions = []
+    partial_update_time = 0
+    partial_games = 0
     display_mode = 'positions'  # Start with displaying positions
 
     time = 0
     total_games = 0
+    dirty = True
 
     while running:
-        screen.fill(LBLUE)
-        draw_board(screen)
-
-        if position_stats or threatened_stats or threat_stats:
-            render_counts(screen, position_stats, threatened_stats, threat_stats, display_mode)
-            
-        if settings["timeout"] == -1:
-            if input_mode == 'choose_mode':
-                render_text(screen, "Choose search mode (1) Piece Type, (2) Starting Position): ", (10, screen_height - 70), WHITE)
-            elif input_mode == 'piece_type':
-                render_text(screen, "Enter piece type (K)ing, (P)awn, etc: " + piece_type, (10, screen_height - 70), WHITE)
-            elif input_mode == 'piece_color':
-                render_text(screen, "Enter piece color (w)hite / (b)lack: " + piece_color, (10, screen_height - 70), WHITE)
-            elif input_mode == 'position':
-                render_text(screen, "Enter starting position (e.g., a1, b2): " + starting_position, (10, screen_height - 70), WHITE)
-
-        pygame.display.flip()
+        # Only redrawn after an event or a change to what is shown, an idle window costs next to nothing
+        if dirty:
+            if position_stats or threatened_stats or threat_stats:
+                render_counts(screen, position_stats, threatened_stats, threat_stats, display_mode)
+            else:
+                draw_board(screen)
+            if job is not None:
+                render_progress(screen, job)
+                
+            # The progress line takes the prompt's row, and no keys but ESC are read until the analysis is done
+            if settings["timeout"] == -1 and job is None:
+                if input_mode == 'choose_mode':
+                    render_text(screen, "Choose search mode (1) Piece Type, (2) Starting Position): ", (10, screen_height - 70), WHITE)
+                elif input_mode == 'piece_type':
+                    render_text(screen, "Enter piece type (K)ing, (P)awn, etc: " + piece_type, (10, screen_height - 70), WHITE)
+                elif input_mode == 'piece_color':
+                    render_text(screen, "Enter piece color (w)hite / (b)lack: " + piece_color, (10, screen_height - 70), WHITE)
+                elif input_mode == 'position':
+                    render_text(screen, "Enter starting position (e.g., a1, b2): " + starting_position, (10, screen_height - 70), WHITE)
+
+            pygame.display.flip()
+            dirty = False
                     
-        if settings["timeout"] != -1 and first_run == False:
+        if job is not None:
+            # Only cancelling or quitting is possible while the analysis runs
+            for event in pygame.event.get():
+                dirty = True
+                if event.type == pygame.QUIT:
+                    job.cancel()
+                    running = False
+                elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
+                    job.cancel()
+            if job.finished():
+                analysis = job.analysis
+                job = None
+                dirty = True
+                if analysis is not None:
+                    position_stats, threatened_stats, threat_stats = update_positions(analysis, tracked_positions)
+                elif settings["timeout"] != -1:
+                    # Nothing to show or screenshot
+                    running = False
+                else:
+                    position_stats = threatened_stats = threat_stats = None
+                    input_mode = 'choose_mode'
+            elif job.partial is not None and pygame.time.get_ticks() - partial_update_time >= PARTIAL_UPDATE_MS:
+                # Shows the games read so far, so a wrong query can be spotted and cancelled early
+                if job.games_read != partial_games:
+                    position_stats, threatened_stats, threat_stats = update_positions(job.partial, tracked_positions)
+                    partial_games = job.games_read
+                partial_update_time = pygame.time.get_ticks()
+                dirty = True
+        elif settings["timeout"] != -1 and first_run == False:
             time += 1
             
             if (time * 0.01667) >= settings["timeout"]: 
@@ -466,6 +941,7 @@ def main():
             elif time % (settings["timeout"] * 60 // 4) == 0:
                 print(str(settings["timeout"] - int(time * 0.01667)) + " seconds left until exiting.")
             for event in pygame.event.get():
+                dirty = True
                 if event.type == pygame.QUIT:
                     running = False
                 elif event.type == pygame.KEYDOWN:
@@ -473,14 +949,15 @@ def main():
                         running = False
         elif isinstance(settings["search_mode"], int) and first_run:
             if settings["search_mode"] == 1:
-                render_text(screen, "Calculating...", (screen_width / 2, screen_height / 2), WHITE, 70, True, True)
-                position_stats, threatened_stats, threat_stats = analyze_games_by_piece_type(games, settings["piece_type"], settings["piece_color"], xy_coords)
+                tracked_positions = query_positions(('piece_type', settings["piece_type"], settings["piece_color"]))
             else:
-                render_text(screen, "Calculating...", (screen_width / 2, screen_height / 2), WHITE, 70, True, True)
-                position_stats, threatened_stats, threat_stats = update_positions(games, [settings["starting_position"]], xy_coords)
+                tracked_positions = query_positions(('position', settings["starting_position"]))
+            job = AnalysisJob(file_path, settings["indexed_games"])
             first_run = False
+            dirty = True
         else:
             for event in pygame.event.get():
+                dirty = True
                 if event.type == pygame.QUIT:
                     running = False
 
@@ -498,7 +975,6 @@ def main():
                             display_mode = 'positions'
 
                     if input_mode == 'choose_mode':
-                        total_games = 0
                         if event.key == pygame.K_1 or event.key == pygame.K_KP1:
                             input_mode = 'piece_type'
                         elif event.key == pygame.K_2 or event.key == pygame.K_KP2:
@@ -515,9 +991,11 @@ def main():
                     elif input_mode == 'piece_color':
                         if event.key == pygame.K_RETURN or event.key == pygame.K_KP_ENTER:
                             input_mode = 'analyze_piece_type'
-                            
-                            render_text(screen, "Calculating...", (screen_width / 2, screen_height / 2), WHITE, 70, True, True)
-                            position_stats, threatened_stats, threat_stats = analyze_games_by_piece_type(games, piece_type, piece_color, xy_coords)
+                            tracked_positions = query_positions(('piece_type', piece_type, piece_color))
+                            if analysis is None:
+                                job = AnalysisJob(file_path, settings["indexed_games"])
+                            else:
+                                position_stats, threatened_stats, threat_stats = update_positions(analysis, tracked_positions)
                         elif event.key == pygame.K_BACKSPACE:
                             piece_color = piece_color[:-1]
                         else:
@@ -526,8 +1004,11 @@ def main():
                     elif input_mode == 'position':
                         if event.key == pygame.K_RETURN or event.key == pygame.K_KP_ENTER:
                             input_mode = 'analyze_position'
-                            render_text(screen, "Calculating...", (screen_width / 2, screen_height / 2), WHITE, 70, True, True)
-                            position_stats, threatened_stats, threat_stats = update_positions(games, [starting_position], xy_coords)
+                            tracked_positions = query_positions(('position', starting_position))
+                            if analysis is None:
+                                job = AnalysisJob(file_path, settings["indexed_games"])
+                            else:
+                                position_stats, threatened_stats, threat_stats = update_positions(analysis, tracked_positions)
                         elif event.key == pygame.K_BACKSPACE:
                             starting_position = starting_position[:-1]
                         else:
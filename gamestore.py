@@ -0,0 +1,219 @@
+import argparse
+import io
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from collections import namedtuple
+from pgnio import balanced_ranges, load_index, RESULTS
+
+# Pre-parsed game store (myfile.pgs), written once from a PGN so chesscellavg.py can replay the games without
+# reading any SAN again. Layout:
+#   header   magic, game count, move count, offsets of the sections below, hash of the source PGN's contents
+#   records  one fixed size record per game (string table offset and length, elos, result, flags)
+#   offsets  game count + 1 uint64, the index of every game's first move in moves (the last one is the move count)
+#   moves    one uint16 per move, from square | to square << 6 | promotion piece type << 12 (0 for none)
+#   strings  White, Black, Date, ECO and starting FEN (empty for the standard position) of every game, tab separated
+# Everything is little endian and read back through mmap. Only the mainline is stored, checked move by move
+# when the store is written, so a game that chesscellavg.py would drop for an illegal move is stored without moves.
+
+STORE_MAGIC = b'PGNSTR01'
+STORE_HEADER = struct.Struct('<8sQQQQQQ16s')
+STORE_RECORD = struct.Struct('<QIHHBB')
+STORE_SUFFIX = '.pgs'
+
+# Record flags
+NO_GAME = 1
+ILLEGAL_MOVE = 2
+CHESS960 = 4
+CUSTOM_START = 8
+
+StoredGame = namedtuple('StoredGame', ['moves', 'fen', 'chess960', 'flags'])
+StoredHeaders = namedtuple('StoredHeaders', ['white', 'black', 'result', 'white_elo', 'black_elo', 'date', 'eco'])
+
+
+def encode_move(move):
+    return move.from_square | move.to_square << 6 | (move.promotion or 0) << 12
+
+
+def is_game_store(file_path):
+    try:
+        with open(file_path, 'rb') as f:
+            return f.read(len(STORE_MAGIC)) == STORE_MAGIC
+    except OSError:
+        return False
+
+
+def padding(size):
+    # Keeps the uint64 and uint16 sections 8 byte aligned
+    return -size % 8
+
+
+def write_store(pgn_path, out):
+    # Writes the store of pgn_path to the seekable binary file out. Every section goes to a temporary file
+    # of its own first, so memory use doesn't grow with the number of games.
+    import chess
+    import chess.pgn
+
+    index = load_index(pgn_path)
+    move_count = 0
+    strings_size = 0
+    try:
+        with tempfile.TemporaryFile() as records, tempfile.TemporaryFile() as offsets, \
+                tempfile.TemporaryFile() as moves, tempfile.TemporaryFile() as strings:
+            for n in range(len(index)):
+                info = index[n]
+                game = chess.pgn.read_game(io.StringIO(index.read_game(n)))
+                flags = 0
+                fen = ''
+                encoded = []
+                if game is None:
+                    flags |= NO_GAME
+                else:
+                    board = game.board()
+                    if board.chess960:
+                        flags |= CHESS960
+                    if board.fen() != chess.STARTING_FEN:
+                        flags |= CUSTOM_START
+                        fen = board.fen()
+                    for move in game.mainline_moves():
+                        if move not in board.legal_moves:
+                            flags |= ILLEGAL_MOVE
+                            encoded = []
+                            break
+                        encoded.append(encode_move(move))
+                        board.push(move)
+
+                text = '\t'.join(value.replace('\t', ' ') for value in (info.white, info.black, info.date, info.eco, fen)).encode('utf-8')
+                records.write(STORE_RECORD.pack(strings_size, len(text), info.white_elo, info.black_elo, RESULTS.index(info.result), flags))
+                offsets.write(struct.pack('<Q', move_count))
+                moves.write(struct.pack(f'<{len(encoded)}H', *encoded))
+                strings.write(text)
+                strings_size += len(text)
+                move_count += len(encoded)
+                if (n + 1) % 100000 == 0:
+                    print(f"Stored {n + 1} of {len(index)} games")
+            offsets.write(struct.pack('<Q', move_count))
+
+            game_count = len(index)
+            records_offset = STORE_HEADER.size + padding(STORE_HEADER.size)
+            offsets_offset = records_offset + game_count * STORE_RECORD.size
+            offsets_offset += padding(offsets_offset)
+            moves_offset = offsets_offset + (game_count + 1) * 8
+            strings_offset = moves_offset + move_count * 2
+            strings_offset += padding(strings_offset)
+
+            out.write(STORE_HEADER.pack(STORE_MAGIC, game_count, move_count, records_offset, offsets_offset, moves_offset,
+                                        strings_offset, bytes.fromhex(index.content_hash)))
+            for section, offset in ((records, records_offset), (offsets, offsets_offset), (moves, moves_offset), (strings, strings_offset)):
+                out.write(bytes(offset - out.tell()))
+                section.seek(0)
+                shutil.copyfileobj(section, out)
+            out.flush()
+    finally:
+        index.close()
+    return game_count, move_count
+
+
+class GameStore:
+    def __init__(self, store_path, store_file, data):
+        self.store_path = store_path
+        self.store_file = store_file
+        self.data = data
+        _, self.count, self.move_count, self.records_offset, offsets_offset, moves_offset, self.strings_offset, digest = \
+            STORE_HEADER.unpack_from(data, 0)
+        # The same hash as the source PGN's index, so the store and its PGN share cached analyses
+        self.content_hash = digest.hex()
+        view = memoryview(data)
+        self.offsets = view[offsets_offset:offsets_offset + (self.count + 1) * 8].cast('Q')
+        self.moves = view[moves_offset:moves_offset + self.move_count * 2].cast('H')
+        view.release()
+        if sys.byteorder != 'little':
+            # Big endian machines get a byte swapped copy instead of the mapping
+            for name in ('offsets', 'moves'):
+                swapped = array(getattr(self, name).format, getattr(self, name).tobytes())
+                swapped.byteswap()
+                getattr(self, name).release()
+                setattr(self, name, swapped)
+
+    def __len__(self):
+        return self.count
+
+    def record(self, n):
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError(f"game {n} out of range, the store has {self.count} games")
+        return STORE_RECORD.unpack_from(self.data, self.records_offset + n * STORE_RECORD.size)
+
+    def strings(self, text_offset, text_length):
+        start = self.strings_offset + text_offset
+        return bytes(self.data[start:start + text_length]).decode('utf-8', 'replace').split('\t')
+
+    def headers(self, n):
+        text_offset, text_length, white_elo, black_elo, result, _ = self.record(n)
+        white, black, date, eco, _ = self.strings(text_offset, text_length)
+        return StoredHeaders(white, black, RESULTS[result], white_elo, black_elo, date, eco)
+
+    def read_game(self, n):
+        text_offset, text_length, _, _, _, flags = self.record(n)
+        fen = self.strings(text_offset, text_length)[4] if flags & CUSTOM_START else None
+        # Copied out of the mapping, a view into it would keep the store from closing
+        moves = self.moves[self.offsets[n]:self.offsets[n + 1]].tolist()
+        return StoredGame(moves, fen, bool(flags & CHESS960), flags)
+
+    def iter_games(self, start=0, stop=None):
+        for n in range(start, self.count if stop is None else min(stop, self.count)):
+            yield self.read_game(n)
+
+    def chunks(self, chunk_count, start=0):
+        # Splits the games from start on into at most chunk_count contiguous (start, stop) ranges of similar move count
+        return balanced_ranges(start, self.count, self.offsets.__getitem__, self.move_count, chunk_count)
+
+    def close(self):
+        if isinstance(self.offsets, memoryview):
+            self.offsets.release()
+            self.moves.release()
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.store_file is not None:
+            self.store_file.close()
+            self.store_file = None
+
+
+def open_store(store_path):
+    store_file = open(store_path, 'rb')
+    data = mmap.mmap(store_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return GameStore(store_path, store_file, data)
+
+
+def iter_store_file(store_path):
+    store = open_store(store_path)
+    try:
+        yield from store.iter_games()
+    finally:
+        store.close()
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="PGN Game Store Converter")
+    parser.add_argument('--input', type=str, required=True, help='Path to the input PGN file.')
+    parser.add_argument('--output', type=str, help='Path of the game store, the input path with .pgs instead of .pgn by default.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    output = args.output or os.path.splitext(args.input)[0] + STORE_SUFFIX
+    temp_path = output + '.tmp'
+    with open(temp_path, 'wb') as out:
+        game_count, move_count = write_store(args.input, out)
+    os.replace(temp_path, output)
+    print(f"Stored {game_count} games ({move_count} moves) from {args.input} in {output}, {os.path.getsize(output)} bytes")
+
+
+if __name__ == "__main__":
+    main()
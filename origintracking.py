@@ -0,0 +1,199 @@
+import chess
+import chess.pgn
+
+# Follows the 32 starting pieces through a game for the analysis in chesscellavg.py. Everything that needs
+# python-chess lives here, so chesscellavg.py only pays for importing it once games are actually read.
+
+# Starting squares of the 32 pieces, a piece keeps its origin for the whole game (promoted pawns included)
+ORIGIN_SQUARES = [
+    chess.A1, chess.B1, chess.C1, chess.D1, chess.E1, chess.F1, chess.G1, chess.H1,
+    chess.A2, chess.B2, chess.C2, chess.D2, chess.E2, chess.F2, chess.G2, chess.H2,
+    chess.A7, chess.B7, chess.C7, chess.D7, chess.E7, chess.F7, chess.G7, chess.H7,
+    chess.A8, chess.B8, chess.C8, chess.D8, chess.E8, chess.F8, chess.G8, chess.H8
+]
+
+# Rook move of a castling move, keyed by the king's target square
+CASTLING_ROOK_MOVES = {
+    chess.G1: (chess.H1, chess.F1),
+    chess.C1: (chess.A1, chess.D1),
+    chess.G8: (chess.H8, chess.F8),
+    chess.C8: (chess.A8, chess.D8)
+}
+
+
+class OriginTracker:
+    # origin_at maps every square to the index of the starting piece standing on it (-1 when empty),
+    # square_of is the reverse (-1 once the piece is captured), and visits counts how often each
+    # (origin, square) pair was reached, keyed by origin * 64 + square.
+    def __init__(self):
+        self.origin_at = [-1] * 64
+        self.square_of = list(ORIGIN_SQUARES)
+        self.visits = {}
+        self.positions_found = False
+        for origin, square in enumerate(ORIGIN_SQUARES):
+            self.origin_at[square] = origin
+            self.visits[origin * 64 + square] = 1
+
+        # Per ply threat counts, keyed like visits. attacks holds every origin's attack bitboard from the
+        # previous ply, changed the squares whose occupancy changed since then and moved the origins that moved.
+        self.threatened = {}
+        self.threatening = {}
+        self.attacks = None
+        self.changed = 0
+        self.moved = []
+
+    def remove_piece(self, square):
+        origin = self.origin_at[square]
+        if origin >= 0:
+            self.origin_at[square] = -1
+            self.square_of[origin] = -1
+        self.changed |= chess.BB_SQUARES[square]
+
+    def move_piece(self, from_square, to_square):
+        origin_at = self.origin_at
+        captured = origin_at[to_square]
+        if captured >= 0:
+            self.square_of[captured] = -1
+        origin = origin_at[from_square]
+        origin_at[from_square] = -1
+        origin_at[to_square] = origin
+        self.changed |= chess.BB_SQUARES[from_square] | chess.BB_SQUARES[to_square]
+        if origin >= 0:
+            self.square_of[origin] = to_square
+            self.moved.append(origin)
+            key = origin * 64 + to_square
+            self.visits[key] = self.visits.get(key, 0) + 1
+            return True
+        return False
+
+    def track_move(self, board, move):
+        # Call with the board before the move is pushed
+        to_square = move.to_square
+
+        # Captured pieces simply get overwritten, en passant removes the pawn behind the target square
+        if board.is_en_passant(move):
+            self.remove_piece(to_square - 8 if board.turn == chess.WHITE else to_square + 8)
+
+        if self.move_piece(move.from_square, to_square):
+            self.positions_found = True
+
+        # Handle castling, the king moved above and the rook moves here
+        if board.is_castling(move) and to_square in CASTLING_ROOK_MOVES:
+            self.move_piece(*CASTLING_ROOK_MOVES[to_square])
+
+    def track_threats(self, board):
+        # Call with the board after the move is pushed. Counts, for every tracked piece, the opponent pieces
+        # it attacks (threatening, on the attacked square) and is attacked by (threatened, on its own square).
+        square_of = self.square_of
+        attacks = self.attacks
+        if attacks is None:
+            attacks = self.attacks = [board.attacks_mask(square) if square >= 0 else 0 for square in square_of]
+        else:
+            for origin in self.moved:
+                attacks[origin] = board.attacks_mask(square_of[origin])
+            # Besides the pieces that moved, only sliders whose rays ran over a changed square see different attacks
+            changed = self.changed
+            sliders = board.bishops | board.rooks | board.queens
+            for origin in range(32):
+                if attacks[origin] & changed:
+                    square = square_of[origin]
+                    if square < 0:
+                        attacks[origin] = 0
+                    elif sliders & chess.BB_SQUARES[square]:
+                        attacks[origin] = board.attacks_mask(square)
+        self.changed = 0
+        self.moved = []
+
+        origin_at = self.origin_at
+        threatened = self.threatened
+        threatening = self.threatening
+        # The first 16 origins are white's pieces and attack black's pieces
+        targets = board.occupied_co[chess.BLACK]
+        for origin in range(32):
+            if origin == 16:
+                targets = board.occupied_co[chess.WHITE]
+            hits = attacks[origin] & targets
+            if not hits or square_of[origin] < 0:
+                continue
+            for target in chess.scan_forward(hits):
+                key = origin * 64 + target
+                threatening[key] = threatening.get(key, 0) + 1
+                key = origin_at[target] * 64 + target
+                if key >= 0:
+                    threatened[key] = threatened.get(key, 0) + 1
+
+class TrackingVisitor(chess.pgn.BaseVisitor):
+    # Tracks the pieces while python-chess parses the mainline, so trusted input needs no second replay.
+    # Pass functools.partial(TrackingVisitor, ply_threats, verbose) as the Visitor of chess.pgn.read_game.
+    def __init__(self, ply_threats=True, verbose=False):
+        self.ply_threats = ply_threats
+        self.verbose = verbose
+
+    def begin_game(self):
+        self.tracker = OriginTracker()
+        self.board = None
+        self.move_pushed = False
+        # A null move (--) parses but isn't legal, the game is dropped like the legality check of a replay drops it
+        self.illegal_move = None
+
+    def begin_variation(self):
+        return chess.pgn.SKIP
+
+    def begin_parse_san(self, board, san):
+        if self.illegal_move is not None:
+            return chess.pgn.SKIP
+
+    def visit_move(self, board, move):
+        if not move:
+            self.illegal_move = move
+            return
+        self.tracker.track_move(board, move)
+        self.move_pushed = True
+
+    def visit_board(self, board):
+        # Also called after a move that failed to parse, only count the plies that were played
+        self.board = board
+        if self.move_pushed and self.ply_threats:
+            self.tracker.track_threats(board)
+        self.move_pushed = False
+
+    def handle_error(self, error):
+        # Same as reading the game normally, the rest of the game after a bad move is left out
+        if self.verbose:
+            print(f"Error while reading game: {error}")
+
+    def result(self):
+        return self
+
+def attacked_mask(board, color):
+    # Every square attacked by at least one piece of color, as a bitboard
+    attacked = 0
+    for square in chess.scan_forward(board.occupied_co[color]):
+        attacked |= board.attacks_mask(square)
+    return attacked
+
+def final_board_threats(board, piece_square, threatening_by_color, verbose=False):
+    # Returns how often the piece on piece_square counts as threatened and which squares it counts as threatening
+    piece_color = board.color_at(piece_square)
+    if piece_color is None:
+        return None
+    opponent = not piece_color
+    if verbose:
+        print(f"Piece at {chess.SQUARE_NAMES[piece_square]}: {chess.PIECE_NAMES[board.piece_type_at(piece_square)]} ({chess.COLOR_NAMES[piece_color]})")
+
+    # threatened by opponent, counted once for every opponent piece on the board
+    threatened_count = 0
+    if board.attackers_mask(opponent, piece_square):
+        threatened_count = chess.popcount(board.occupied_co[opponent])
+        if verbose:
+            print(f"Position {chess.SQUARE_NAMES[piece_square]} is threatened by opponent")
+
+    # threatening opponent, every opponent piece attacked by any piece of this color
+    if piece_color not in threatening_by_color:
+        threatening_by_color[piece_color] = list(chess.scan_forward(attacked_mask(board, piece_color) & board.occupied_co[opponent]))
+    threatening_squares = threatening_by_color[piece_color]
+    if verbose:
+        for square in threatening_squares:
+            print(f"Position {chess.SQUARE_NAMES[square]} is threatened by {chess.COLOR_NAMES[piece_color]}")
+
+    return threatened_count, threatening_squares
@@ -1,113 +1,176 @@
-import pygame
-import chess
-import chess.pgn
-import io
 import argparse
-import re
+import io
 import sys
-
-# Initialize pygame
-pygame.init()
-
-def consolidate_text_blocks(input_string):
-    cleaned_string = re.sub(r'\n{3,}', '\n\n', input_string)
-    cleaned_string = re.sub(r'(\[.*?\])(?:\n{2,}\[.*?\])+', lambda m: '\n'.join(m.group().split('\n\n')), cleaned_string)
-    return cleaned_string
-
-def parse_and_filter_pgn(file_path, player_name, result_filter, color_filter):
-    with open(file_path, 'r') as f:
-        content = consolidate_text_blocks(f.read())
-    
-    games = content.split('\n[Event ')
-    games = ['[Event ' + game for game in games if game]
-
-    filtered_games = []
-    for game_data in games:
-        game_stream = io.StringIO(game_data)
-        game = chess.pgn.read_game(game_stream)
-        if game:
-            white_player = game.headers.get('White', '').strip().lower()
-            black_player = game.headers.get('Black', '').strip().lower()
-            result = game.headers.get('Result', '*')
-
-            if player_name in [white_player, black_player] or (player_name == "" and color_filter == ""):
-                if color_filter == 'white' and player_name != white_player and player_name != "":
-                    continue
-                elif color_filter == 'black' and player_name != black_player and player_name != "":
-                    continue
-                if result_filter == 'win':
-                    if (player_name == white_player and result == '1-0') or \
-                       (player_name == black_player and result == '0-1'):
-                        filtered_games.append(game_data)
-                elif result_filter == 'loss':
-                    if (player_name == white_player and result == '0-1') or \
-                       (player_name == black_player and result == '1-0'):
-                        filtered_games.append(game_data)
-                elif result_filter == 'draw':
-                    if result == '1/2-1/2':
-                        filtered_games.append(game_data)
-                elif result_filter == 'all':
-                    filtered_games.append(game_data)
-            elif player_name == "":
-                if result_filter == 'win' and result == '1-0':
-                    filtered_games.append(game_data)
-                elif result_filter == 'loss' and result == '0-1':
-                    filtered_games.append(game_data)
-                elif result_filter == 'draw' and result == '1/2-1/2':
-                    filtered_games.append(game_data)
-                elif result_filter == 'all':
-                    filtered_games.append(game_data)
-
-    return filtered_games
-
-def split_and_filter_pgn(file_path, player_name, color_filter):
-    with open(file_path, 'r') as f:
-        content = consolidate_text_blocks(f.read())
-    
-    games = content.split('\n[Event ')
-    games = ['[Event ' + game for game in games if game]
-
-    win_games = []
-    loss_games = []
-    draw_games = []
-
-    for game_data in games:
-        game_stream = io.StringIO(game_data)
-        game = chess.pgn.read_game(game_stream)
-        if game:
-            white_player = game.headers.get('White', '').strip().lower()
-            black_player = game.headers.get('Black', '').strip().lower()
-            result = game.headers.get('Result', '*')
-
-
-            if player_name in [white_player, black_player] or (player_name == "" and color_filter == ""):
-                if color_filter == 'white' and player_name != white_player:
-                    continue
-                elif color_filter == 'black' and player_name != black_player:
-                    continue
-                if (player_name == white_player and result == '1-0') or \
-                   (player_name == black_player and result == '0-1'):
-                    win_games.append(game_data)
-                elif (player_name == white_player and result == '0-1') or \
-                     (player_name == black_player and result == '1-0'):
-                    loss_games.append(game_data)
-                elif result == '1/2-1/2':
-                    draw_games.append(game_data)
-            elif player_name == "":
-                if result == '1-0':
-                    win_games.append(game_data)
-                elif result == '0-1':
-                    loss_games.append(game_data)
-                elif result == '1/2-1/2':
-                    draw_games.append(game_data)
-
-    return win_games, loss_games, draw_games
+from pgnio import load_index
+
+OUTPUT_BUFFER_SIZE = 1024 * 1024
+# Most bytes of the input one worker task covers, so a worker's results stay small on multi-GB files
+CHUNK_SIZE = 32 * 1024 * 1024
+
+def joins_tag_lines(previous, in_block, line):
+    # Whether the blank line between previous and line is left out. A block of tag lines is a line ending in a [...]
+    # followed by lines starting with one. A line inside a block only carries it on if its first ] ends the line,
+    # otherwise a new block can only start after that ].
+    text = previous.rstrip('\r\n')
+    if in_block:
+        end = text.index(']')
+        if end == len(text) - 1:
+            return line.startswith('[') and ']' in line[1:]
+        text = text[end + 1:]
+    return text.endswith(']') and '[' in text[:-1] and line.startswith('[') and ']' in line[1:]
+
+def normalize_pgn_lines(lines):
+    # Yields the lines with every run of blank lines cut down to one, and no blank lines between consecutive
+    # tag lines. Only the previous line and the number of blank lines after it are kept, so any amount of text
+    # can be streamed through. A blank line ending in \r\n counts too and is kept with its own line ending.
+    previous = None
+    in_block = False
+    blank_lines = 0
+    blank_line = '\n'
+    for line in lines:
+        if line in ('\n', '\r\n'):
+            blank_lines += 1
+            blank_line = line
+            continue
+        if blank_lines:
+            if previous is None:
+                # Blank lines at the very start are only cut down to two
+                yield blank_line * min(blank_lines, 2)
+                in_block = False
+            else:
+                in_block = joins_tag_lines(previous, in_block, line)
+                if not in_block:
+                    yield blank_line
+            blank_lines = 0
+        else:
+            in_block = False
+        yield line
+        previous = line
+    if blank_lines:
+        yield blank_line * min(blank_lines, 2) if previous is None else blank_line
+
+def read_game_text(index, game_number):
+    # The game's original text from the PGN file as it is written out, only fetched for games that are kept
+    return ''.join(normalize_pgn_lines(io.StringIO(index.read_game(game_number)))).rstrip('\n') + '\n\n'
+
+def filter_game(white_player, black_player, result, player_name, result_filter, color_filter):
+    if player_name in [white_player, black_player] or (player_name == "" and color_filter == ""):
+        if color_filter == 'white' and player_name != white_player and player_name != "":
+            return False
+        elif color_filter == 'black' and player_name != black_player and player_name != "":
+            return False
+        if result_filter == 'win':
+            return (player_name == white_player and result == '1-0') or \
+                   (player_name == black_player and result == '0-1')
+        elif result_filter == 'loss':
+            return (player_name == white_player and result == '0-1') or \
+                   (player_name == black_player and result == '1-0')
+        elif result_filter == 'draw':
+            return result == '1/2-1/2'
+        return result_filter == 'all'
+    elif player_name == "":
+        return (result_filter == 'win' and result == '1-0') or \
+               (result_filter == 'loss' and result == '0-1') or \
+               (result_filter == 'draw' and result == '1/2-1/2') or \
+               result_filter == 'all'
+    return False
+
+def split_game(white_player, black_player, result, player_name, color_filter):
+    # Returns 0 for wins, 1 for losses, 2 for draws and None for games that aren't kept
+    if player_name in [white_player, black_player] or (player_name == "" and color_filter == ""):
+        if color_filter == 'white' and player_name != white_player:
+            return None
+        elif color_filter == 'black' and player_name != black_player:
+            return None
+        if (player_name == white_player and result == '1-0') or \
+           (player_name == black_player and result == '0-1'):
+            return 0
+        elif (player_name == white_player and result == '0-1') or \
+             (player_name == black_player and result == '1-0'):
+            return 1
+        elif result == '1/2-1/2':
+            return 2
+    elif player_name == "":
+        if result == '1-0':
+            return 0
+        elif result == '0-1':
+            return 1
+        elif result == '1/2-1/2':
+            return 2
+    return None
+
+def filter_games_in_range(index, start, stop, player_name, result_filter, color_filter):
+    # Yields (output, game text) for the kept games in start..stop. The decision only uses the tag lines stored
+    # in the sidecar index, so no moves are parsed and repeat runs don't rescan the file.
+    for game_number in range(start, stop):
+        game = index[game_number]
+        white_player = game.white.strip().lower()
+        black_player = game.black.strip().lower()
+        if result_filter == 'split':
+            output = split_game(white_player, black_player, game.result, player_name, color_filter)
+        else:
+            output = 0 if filter_game(white_player, black_player, game.result, player_name, result_filter, color_filter) else None
+        if output is not None:
+            yield output, read_game_text(index, game_number)
+
+def filter_game_range(task):
+    # Runs in a worker process, returns the text and game count of every output for one range of games
+    file_path, start, stop, player_name, result_filter, color_filter = task
+    texts = [[], [], []]
+    index = load_index(file_path)
+    try:
+        for output, game_data in filter_games_in_range(index, start, stop, player_name, result_filter, color_filter):
+            texts[output].append(game_data)
+    finally:
+        index.close()
+    return [(''.join(games), len(games)) for games in texts]
+
+def filter_pgn(file_path, player_name, result_filter, color_filter, workers=1):
+    # Yields (output, text, game count) in file order. With several workers, byte balanced ranges of games
+    # (every range starts on an [Event line) are filtered in parallel and handed back in order.
+    if workers <= 1:
+        index = load_index(file_path)
+        try:
+            for output, game_data in filter_games_in_range(index, 0, len(index), player_name, result_filter, color_filter):
+                yield output, game_data, 1
+        finally:
+            index.close()
+        return
+
+    # Only imported when workers are used, a plain filter run starts faster without it
+    import multiprocessing
+    with multiprocessing.get_context('spawn').Pool(workers) as pool:
+        # A file without an index yet has it built by the same workers, each scanning a byte range of the file
+        index = load_index(file_path, pool, workers * 4)
+        ranges = index.chunks(max(workers * 4, index.file_size // CHUNK_SIZE))
+        index.close()
+        tasks = [(file_path, start, stop, player_name, result_filter, color_filter) for start, stop in ranges]
+        for outputs in pool.imap(filter_game_range, tasks):
+            for output, (text, count) in enumerate(outputs):
+                if count:
+                    yield output, text, count
+
+def parse_and_filter_pgn(file_path, player_name, result_filter, color_filter, workers=1):
+    # Returns the kept games' text, in pieces of one or more games
+    return [text for _, text, _ in filter_pgn(file_path, player_name, result_filter, color_filter, workers)]
+
+def split_and_filter_pgn(file_path, player_name, color_filter, base_file_name, workers=1):
+    # Writes every game to its wins/losses/draws file as soon as it is classified, nothing is collected in memory
+    output_files = [open(f"{base_file_name}_{name}.pgn", 'w', buffering=OUTPUT_BUFFER_SIZE) for name in ('wins', 'losses', 'draws')]
+    counts = [0, 0, 0]
+    try:
+        for output, text, count in filter_pgn(file_path, player_name, 'split', color_filter, workers):
+            output_files[output].write(text)
+            counts[output] += count
+    finally:
+        for f in output_files:
+            f.close()
+    return counts
 
 def save_filtered_pgn(filtered_games, save_file_name):
-    with open(save_file_name, 'w') as f:
+    with open(save_file_name, 'w', buffering=OUTPUT_BUFFER_SIZE) as f:
         for game_data in filtered_games:
             f.write(game_data)
-            f.write('\n')
 
 def get_color_filter():
     while True:
@@ -123,9 +186,9 @@ def main():
     parser.add_argument('--process', type=str, choices=['win', 'loss', 'draw', 'all', 'split'], help="Type of result to filter.")
     parser.add_argument('--playername', type=str, help="Player name to filter games by.")
     parser.add_argument('--color', type=str, choices=['white', 'black', 'both'], help="Color to filter games by.")
+    parser.add_argument('--workers', type=int, default=1, help="Number of processes to filter with. Default is 1.")
     args = parser.parse_args()
 
-
     if args.input:
         file_path = args.input.strip().lower()
         if args.playername is not None:
@@ -151,8 +214,6 @@ def main():
         result_filter = input("Enter result filter (win/loss/draw/all/split): ").strip().lower()
 
     if result_filter == 'split':
-        win_games, loss_games, draw_games = split_and_filter_pgn(file_path, player_name, color_filter)
-        
         if args.output:
             base_file_name = args.output.strip()
             if ".pgn" in args.output:
@@ -162,14 +223,13 @@ def main():
             base_file_name = input("Enter the base save file name for split filtered games (without .pgn): ").strip()
             if not base_file_name:
                 base_file_name = "filtered_games"
-        
-        save_filtered_pgn(win_games, f"{base_file_name}_wins.pgn")
-        save_filtered_pgn(loss_games, f"{base_file_name}_losses.pgn")
-        save_filtered_pgn(draw_games, f"{base_file_name}_draws.pgn")
-        
+
+        win_count, loss_count, draw_count = split_and_filter_pgn(file_path, player_name, color_filter, base_file_name, args.workers)
+
+        print(f"{win_count} wins, {loss_count} losses and {draw_count} draws.")
         print(f"Split filtered games saved to '{base_file_name}_wins.pgn', '{base_file_name}_losses.pgn', and '{base_file_name}_draws.pgn'.")
     else:
-        filtered_games = parse_and_filter_pgn(file_path, player_name, result_filter, color_filter)
+        filtered_games = parse_and_filter_pgn(file_path, player_name, result_filter, color_filter, args.workers)
 
         
         if filtered_games:
@@ -185,7 +245,5 @@ def main():
             save_filtered_pgn(filtered_games, save_file_name)
             print(f"Filtered games saved to '{save_file_name}'")
 
-    pygame.quit()
-
 if __name__ == "__main__":
     main()
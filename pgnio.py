@@ -0,0 +1,353 @@
+import hashlib
+import mmap
+import os
+import re
+import shutil
+import struct
+import tempfile
+from collections import namedtuple
+
+# Shared PGN file helpers for chesscellavg.py and pgnfilter.py
+
+GAME_START = '[Event '
+
+
+def read_pgn_games(f):
+    # Yields one game's text at a time so only a single game is ever held in memory.
+    # Blank stretches (e.g. before the first game) are not games and are left out.
+    lines = []
+    has_content = False
+    for line in f:
+        if line.startswith(GAME_START) and lines:
+            if has_content:
+                yield ''.join(lines)
+            lines = []
+            has_content = False
+        lines.append(line)
+        has_content = has_content or not line.isspace()
+    if has_content:
+        yield ''.join(lines)
+
+
+def iter_pgn_file(file_path):
+    with open(file_path, 'r') as f:
+        yield from read_pgn_games(f)
+
+
+# Sidecar game index (myfile.pgn.idx)
+#
+# Built once per PGN and rebuilt whenever the PGN's size or mtime changes. Layout:
+#   header   magic, PGN size, PGN mtime, game count, offset of the string table, hash of the PGN's contents
+#   records  one fixed size record per game (byte offset, byte length, elos, result)
+#   strings  White, Black, Date and ECO of every game, tab separated
+# The file is read back through mmap so opening it costs nothing regardless of the game count.
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'PGNIDX04'
+INDEX_HEADER = struct.Struct('<8sQqQQ16s')
+INDEX_RECORD = struct.Struct('<QIQIHHB')
+# Most bytes of the file one worker scans at a time while the index is built in parallel
+INDEX_CHUNK_SIZE = 32 * 1024 * 1024
+RESULTS = ('*', '1-0', '0-1', '1/2-1/2')
+TAG_PATTERN = re.compile(rb'^\[([A-Za-z0-9_]+)\s+"(.*)"\]\s*$')
+# What python-chess reports for a missing tag of the seven tag roster, values are kept as written like it does
+TAG_DEFAULTS = {b'White': b'?', b'Black': b'?', b'Date': b'????.??.??', b'Result': b'*'}
+
+IndexedGame = namedtuple('IndexedGame', ['offset', 'length', 'white', 'black', 'result', 'white_elo', 'black_elo', 'date', 'eco'])
+
+
+def index_path_for(pgn_path):
+    return pgn_path + INDEX_SUFFIX
+
+
+def parse_elo(value):
+    try:
+        return max(0, min(int(value), 65535))
+    except ValueError:
+        return 0
+
+
+def scan_pgn_games(f):
+    # Yields (offset, length, tags) for every game in a binary file handle (or any iterable of byte lines), using the same
+    # game boundaries as read_pgn_games. Only the tag lines are looked at, moves are never parsed.
+    offset = 0
+    game_start = 0
+    has_content = False
+    tags = {}
+    for line in f:
+        if line.startswith(b'[Event ') and offset > game_start:
+            if has_content:
+                yield game_start, offset - game_start, tags
+            game_start = offset
+            has_content = False
+            tags = {}
+        if line.startswith(b'['):
+            match = TAG_PATTERN.match(line)
+            if match:
+                tags[match.group(1)] = match.group(2)
+        has_content = has_content or not line.isspace()
+        offset += len(line)
+    if has_content:
+        yield game_start, offset - game_start, tags
+
+
+def hashed_lines(f, digest):
+    for line in f:
+        digest.update(line)
+        yield line
+
+
+def index_entry(offset, length, tags):
+    # The record fields (less the string table offset) and the strings of one game
+    text = b'\t'.join(tags.get(tag, TAG_DEFAULTS.get(tag, b'')).replace(b'\t', b' ') for tag in (b'White', b'Black', b'Date', b'ECO'))
+    result = tags.get(b'Result', TAG_DEFAULTS[b'Result']).decode('ascii', 'replace')
+    return (offset, length, len(text), parse_elo(tags.get(b'WhiteElo', b'')), parse_elo(tags.get(b'BlackElo', b'')),
+            RESULTS.index(result) if result in RESULTS else 0), text
+
+
+def first_game_in_range(f, start, stop):
+    # Seeks the binary file handle f to the first [Event line starting in bytes start..stop and returns its offset,
+    # None when no game starts there. The range at 0 starts at 0 whatever its first line is, like scan_pgn_games.
+    if start >= stop:
+        return None
+    if start == 0:
+        f.seek(0)
+        return 0
+    f.seek(start - 1)
+    offset = start - 1 + len(f.readline())
+    while offset < stop:
+        line = f.readline()
+        if not line:
+            return None
+        if line.startswith(b'[Event '):
+            f.seek(offset)
+            return offset
+        offset += len(line)
+    return None
+
+
+def lines_until(f, offset, stop):
+    # Yields the lines of f from offset on up to the first [Event line at or after byte stop, where the next range's games begin
+    for line in f:
+        if offset >= stop and line.startswith(b'[Event '):
+            return
+        yield line
+        offset += len(line)
+
+
+def scan_index_range(task):
+    # Runs in a worker process, returns the record fields and strings of the games starting in one byte range
+    pgn_path, start, stop = task
+    entries = []
+    strings = []
+    with open(pgn_path, 'rb') as f:
+        base = first_game_in_range(f, start, stop)
+        if base is not None:
+            for offset, length, tags in scan_pgn_games(lines_until(f, base, stop)):
+                entry, text = index_entry(base + offset, length, tags)
+                entries.append(entry)
+                strings.append(text)
+    return entries, b''.join(strings)
+
+
+def build_index(pgn_path, out, pool=None, chunk_count=1):
+    # Writes the index to the seekable binary file out. Records go straight to out and the strings to a
+    # temporary file that is appended at the end, so memory use doesn't grow with the number of games.
+    # With a multiprocessing pool, byte ranges of the file are scanned in parallel, at least chunk_count of them.
+    count = 0
+    strings_size = 0
+    stat = os.stat(pgn_path)
+    digest = hashlib.blake2b(digest_size=16)
+    out.write(bytes(INDEX_HEADER.size))
+    with tempfile.TemporaryFile() as strings:
+        if pool is None:
+            with open(pgn_path, 'rb') as f:
+                entries = (index_entry(offset, length, tags) for offset, length, tags in scan_pgn_games(hashed_lines(f, digest)))
+                for entry, text in entries:
+                    out.write(INDEX_RECORD.pack(entry[0], entry[1], strings_size, *entry[2:]))
+                    strings.write(text)
+                    strings_size += len(text)
+                    count += 1
+        else:
+            chunk_count = max(1, min(max(chunk_count, stat.st_size // INDEX_CHUNK_SIZE), stat.st_size))
+            tasks = [(pgn_path, stat.st_size * n // chunk_count, stat.st_size * (n + 1) // chunk_count) for n in range(chunk_count)]
+            # imap hands the ranges back in file order, the file is hashed here while the workers scan it
+            results = pool.imap(scan_index_range, tasks)
+            with open(pgn_path, 'rb') as f:
+                for block in iter(lambda: f.read(1024 * 1024), b''):
+                    digest.update(block)
+            for entries, text in results:
+                text_offset = strings_size
+                for entry in entries:
+                    out.write(INDEX_RECORD.pack(entry[0], entry[1], text_offset, *entry[2:]))
+                    text_offset += entry[2]
+                strings.write(text)
+                strings_size += len(text)
+                count += len(entries)
+        strings.seek(0)
+        shutil.copyfileobj(strings, out)
+    out.seek(0)
+    out.write(INDEX_HEADER.pack(INDEX_MAGIC, stat.st_size, stat.st_mtime_ns, count, INDEX_HEADER.size + count * INDEX_RECORD.size, digest.digest()))
+    out.flush()
+
+
+def index_is_current(data, pgn_path):
+    if len(data) < INDEX_HEADER.size:
+        return False
+    magic, size, mtime_ns, _, _, _ = INDEX_HEADER.unpack_from(data, 0)
+    stat = os.stat(pgn_path)
+    return magic == INDEX_MAGIC and size == stat.st_size and mtime_ns == stat.st_mtime_ns
+
+
+class GameIndex:
+    def __init__(self, pgn_path, data, index_file=None):
+        self.pgn_path = pgn_path
+        self.data = data
+        self.index_file = index_file
+        self.pgn_file = None
+        _, self.file_size, _, self.count, self.strings_offset, digest = INDEX_HEADER.unpack_from(data, 0)
+        self.content_hash = digest.hex()
+
+    def __len__(self):
+        return self.count
+
+    def offset_of(self, n):
+        return struct.unpack_from('<Q', self.data, INDEX_HEADER.size + n * INDEX_RECORD.size)[0]
+
+    def __getitem__(self, n):
+        if n < 0:
+            n += self.count
+        if not 0 <= n < self.count:
+            raise IndexError(f"game {n} out of range, the index has {self.count} games")
+        offset, length, text_offset, text_length, white_elo, black_elo, result = \
+            INDEX_RECORD.unpack_from(self.data, INDEX_HEADER.size + n * INDEX_RECORD.size)
+        start = self.strings_offset + text_offset
+        white, black, date, eco = bytes(self.data[start:start + text_length]).decode('utf-8', 'replace').split('\t')
+        return IndexedGame(offset, length, white, black, RESULTS[result], white_elo, black_elo, date, eco)
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self[n]
+
+    def read_game(self, n):
+        record = self[n]
+        if self.pgn_file is None:
+            self.pgn_file = open(self.pgn_path, 'rb')
+        self.pgn_file.seek(record.offset)
+        # Newlines translated as reading the file in text mode does, so CRLF files read the same as iter_pgn_file
+        return self.pgn_file.read(record.length).decode('utf-8', 'replace').replace('\r\n', '\n').replace('\r', '\n')
+
+    def iter_games(self, start=0, stop=None):
+        for n in range(start, self.count if stop is None else min(stop, self.count)):
+            yield self.read_game(n)
+
+    def chunks(self, chunk_count, start=0):
+        # Splits the games from start on into at most chunk_count contiguous (start, stop) ranges of similar byte size
+        return balanced_ranges(start, self.count, self.offset_of, self.file_size, chunk_count)
+
+    def first_game_at(self, offset):
+        # Number of the first game starting at or after byte offset, the game count when there is none
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.offset_of(middle) < offset:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def close(self):
+        if self.pgn_file is not None:
+            self.pgn_file.close()
+            self.pgn_file = None
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        if self.index_file is not None:
+            self.index_file.close()
+            self.index_file = None
+
+
+def balanced_ranges(start, stop, offset_of, end_offset, chunk_count):
+    # Splits items start..stop into at most chunk_count contiguous (start, stop) ranges of similar size, item n
+    # starting at offset_of(n) and the last one ending at end_offset
+    if start >= stop:
+        return []
+    chunk_count = max(1, min(chunk_count, stop - start))
+    first_offset = offset_of(start)
+    ranges = []
+    for chunk in range(1, chunk_count):
+        # First item starting at or after this chunk's share of the total
+        target = first_offset + (end_offset - first_offset) * chunk // chunk_count
+        low, high = start + 1, stop
+        while low < high:
+            middle = (low + high) // 2
+            if offset_of(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < stop:
+            ranges.append((start, low))
+            start = low
+    ranges.append((start, stop))
+    return ranges
+
+
+def prefix_hash(pgn_path, size):
+    # Hash of the first size bytes of the file, the same as the index's content hash of a file that long
+    digest = hashlib.blake2b(digest_size=16)
+    with open(pgn_path, 'rb') as f:
+        while size > 0:
+            data = f.read(min(size, 1024 * 1024))
+            if not data:
+                break
+            digest.update(data)
+            size -= len(data)
+    return digest.hexdigest()
+
+
+def appended_since(index, size, game_count, content_hash):
+    # For a PGN that was size bytes long with game_count games and the given content hash before, returns the
+    # number of the first game appended since. None when the file was changed in any other way (truncated,
+    # rewritten, or text added to its last game), then all of it has to be read again.
+    if index.file_size < size or prefix_hash(index.pgn_path, size) != content_hash:
+        return None
+    start = index.first_game_at(size)
+    if start != game_count:
+        return None
+    # The old last game may only have gained blank lines before the first new game
+    end = index.offset_of(start) if start < index.count else index.file_size
+    with open(index.pgn_path, 'rb') as f:
+        f.seek(size)
+        gap = f.read(end - size)
+    return start if gap.isspace() or not gap else None
+
+
+def open_index_file(pgn_path, index_file):
+    data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ)
+    return GameIndex(pgn_path, data, index_file)
+
+
+def load_index(pgn_path, pool=None, chunk_count=1):
+    # A missing or outdated index is built again, in parallel in pool when one is given
+    index_path = index_path_for(pgn_path)
+    if os.path.exists(index_path):
+        index_file = open(index_path, 'rb')
+        data = mmap.mmap(index_file.fileno(), 0, access=mmap.ACCESS_READ) if os.path.getsize(index_path) else b''
+        if index_is_current(data, pgn_path):
+            return GameIndex(pgn_path, data, index_file)
+        if isinstance(data, mmap.mmap):
+            data.close()
+        index_file.close()
+
+    temp_path = index_path + '.tmp'
+    try:
+        with open(temp_path, 'wb') as out:
+            build_index(pgn_path, out, pool, chunk_count)
+        os.replace(temp_path, index_path)
+    except OSError as e:
+        # Read only location, keep the index in a temporary file for this run
+        print(f"Could not write game index {index_path}: {e}")
+        index_file = tempfile.TemporaryFile()
+        build_index(pgn_path, index_file, pool, chunk_count)
+        return open_index_file(pgn_path, index_file)
+    return open_index_file(pgn_path, open(index_path, 'rb'))
@@ -0,0 +1,81 @@
+import argparse
+import random
+import chess
+
+# Writes PGN files of random legal games, used by benchmark.py for files bigger than the bundled ones.
+# The same seed and options always write the same file.
+
+PLAYERS = [f"Random Player {n}" for n in range(1, 21)]
+UNFINISHED_RESULTS = ('1-0', '0-1', '1/2-1/2')
+LINE_LENGTH = 80
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description="Random PGN Generator")
+    parser.add_argument('--games', type=int, default=10000, help='Number of games to write.')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the random generator, the same seed writes the same games.')
+    parser.add_argument('--max_plies', type=int, default=160, help='Longest game in plies, every game gets a random length of 20 up to this.')
+    parser.add_argument('--output', type=str, help='Output PGN file, random_<games>_<seed>.pgn by default.')
+    return parser.parse_args()
+
+
+def default_output(games, seed):
+    return f"random_{games}_{seed}.pgn"
+
+
+def random_game(rng, number, max_plies):
+    board = chess.Board()
+    moves = []
+    for _ in range(rng.randint(min(20, max_plies), max_plies)):
+        legal_moves = list(board.legal_moves)
+        if not legal_moves:
+            break
+        if board.turn == chess.WHITE:
+            moves.append(f"{board.fullmove_number}.")
+        moves.append(board.san_and_push(rng.choice(legal_moves)))
+
+    # Games that didn't end on the board get a random result, so result filters in pgnfilter.py have something to pick
+    result = board.result() if board.is_game_over() else rng.choice(UNFINISHED_RESULTS)
+    white, black = rng.sample(PLAYERS, 2)
+    headers = [
+        ("Event", f"Random game {number}"),
+        ("Site", "?"),
+        ("Date", f"{rng.randint(2000, 2024)}.{rng.randint(1, 12):02}.{rng.randint(1, 28):02}"),
+        ("Round", "?"),
+        ("White", white),
+        ("Black", black),
+        ("Result", result),
+        ("WhiteElo", str(rng.randint(800, 2800))),
+        ("BlackElo", str(rng.randint(800, 2800))),
+    ]
+
+    lines = [f'[{tag} "{value}"]' for tag, value in headers]
+    lines.append("")
+    line = ""
+    for token in moves + [result]:
+        if line and len(line) + 1 + len(token) > LINE_LENGTH:
+            lines.append(line)
+            line = token
+        else:
+            line = f"{line} {token}" if line else token
+    lines.append(line)
+    return "\n".join(lines) + "\n\n"
+
+
+def write_random_pgn(file_path, games, seed=1, max_plies=160):
+    rng = random.Random(seed)
+    with open(file_path, 'w') as f:
+        for number in range(1, games + 1):
+            f.write(random_game(rng, number, max_plies))
+            if number % 100000 == 0:
+                print(f"Wrote {number} of {games} games")
+    print(f"Wrote {games} random games to {file_path}")
+
+
+def main():
+    args = parse_arguments()
+    write_random_pgn(args.output or default_output(args.games, args.seed), args.games, args.seed, args.max_plies)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import threading
+from time import perf_counter
+
+# Wall time and call count of every stage of an analysis for chesscellavg.py --profile. Stages are timed by
+# wrapping the functions that do their work (enable_profiling in chesscellavg.py), so nothing is timed and
+# nothing costs anything while profiling is off. A stage's time leaves out the stages that ran inside it,
+# which makes the stage times add up to the time spent in all of them.
+
+STAGES = ['read', 'parse', 'replay', 'threats', 'aggregate', 'render']
+
+stats = {stage: [0.0, 0] for stage in STAGES}
+# Time of the nested stages of every timed call running on this thread, innermost last
+nested = threading.local()
+# cProfile profilers of every thread that did work, dumped together at the end
+profilers = []
+memory_dump_path = None
+
+
+def begin():
+    nested.__dict__.setdefault('stack', []).append(0.0)
+    return perf_counter()
+
+
+def end(stage, start, calls=1):
+    elapsed = perf_counter() - start
+    stack = nested.stack
+    stage_stats = stats[stage]
+    stage_stats[0] += elapsed - stack.pop()
+    stage_stats[1] += calls
+    if stack:
+        stack[-1] += elapsed
+
+
+def timed(stage, function):
+    def wrapper(*args, **kwargs):
+        start = begin()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            end(stage, start)
+    return wrapper
+
+
+def timed_iter(stage, iterable):
+    # Times getting every item out of iterable, which must not yield None
+    iterator = iter(iterable)
+    while True:
+        start = begin()
+        item = next(iterator, None)
+        end(stage, start, 0 if item is None else 1)
+        if item is None:
+            return
+        yield item
+
+
+def reset():
+    for stage_stats in stats.values():
+        stage_stats[:] = [0.0, 0]
+
+
+def merge(other):
+    # Adds the stats of a worker process
+    for stage, (seconds, calls) in other.items():
+        stats[stage][0] += seconds
+        stats[stage][1] += calls
+
+
+def print_summary(run_seconds):
+    total = sum(seconds for seconds, _ in stats.values())
+    print(f"\nTime per stage ({run_seconds:.2f} s run, stages run by --workers are summed over the workers):")
+    for stage in STAGES:
+        seconds, calls = stats[stage]
+        share = seconds / total * 100 if total else 0
+        print(f"  {stage:<10} {seconds:10.3f} s {calls:12} calls {share:6.1f}%")
+    print(f"  {'total':<10} {total:10.3f} s")
+
+
+def start_dumps(profile_dump, memory_dump):
+    # cProfile only sees the thread it was started on, other threads go through profiled()
+    global memory_dump_path
+    if profile_dump:
+        import cProfile
+        profiler = cProfile.Profile()
+        profilers.append(profiler)
+        profiler.enable()
+    if memory_dump:
+        import tracemalloc
+        memory_dump_path = memory_dump
+        tracemalloc.start()
+
+
+def profiled(function, *args):
+    # Runs function under a profiler of its own while a --profile_dump is recorded
+    if not profilers:
+        return function(*args)
+    import cProfile
+    profiler = cProfile.Profile()
+    profilers.append(profiler)
+    return profiler.runcall(function, *args)
+
+
+def finish_dumps(profile_dump):
+    if profilers:
+        import pstats
+        profilers[0].disable()
+        pstats.Stats(*profilers).dump_stats(profile_dump)
+        print(f"Profile saved as {profile_dump}, read it with python -m pstats {profile_dump}")
+    if memory_dump_path:
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        snapshot.dump(memory_dump_path)
+        print(f"\nPeak traced memory: {peak / 1024 / 1024:.1f} MB, largest allocations still held:")
+        for statistic in snapshot.statistics('lineno')[:10]:
+            print(f"  {statistic}")
+        print(f"Memory snapshot saved as {memory_dump_path}, load it with tracemalloc.Snapshot.load")
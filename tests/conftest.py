@@ -0,0 +1,32 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+# The scripts live at the top of the repo rather than in a package
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def analyze(monkeypatch):
+    # Runs chesscellavg's load_analysis on a file or list of games with the given settings (no cache and one
+    # worker unless given) and returns the analysis and its game count
+    import chesscellavg
+
+    def run(games, **settings):
+        monkeypatch.setattr(chesscellavg, "settings", dict({"workers": 1}, **settings))
+        analysis = chesscellavg.load_analysis(os.fspath(games) if isinstance(games, os.PathLike) else games)
+        return analysis, chesscellavg.total_games
+    return run
+
+
+@pytest.fixture
+def bundled_copy(tmp_path):
+    # Copies a bundled PGN file into the test's directory, so sidecar indexes aren't written into the repo
+    def copy(name):
+        path = tmp_path / name
+        shutil.copy(os.path.join(REPO_DIR, name), path)
+        return path
+    return copy
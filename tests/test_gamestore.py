@@ -0,0 +1,24 @@
+import pytest
+
+import chesscellavg
+from gamestore import write_store
+
+
+def store_of(pgn_path):
+    store_path = pgn_path.with_suffix('.pgs')
+    with open(store_path, 'wb') as out:
+        write_store(str(pgn_path), out)
+    return store_path
+
+
+@pytest.mark.parametrize('threat_timing', ['ply', 'final'])
+@pytest.mark.parametrize('name', ['castling.pgn', 'enpassant.pgn', 'Levy.pgn'])
+def test_store_matches_pgn(analyze, bundled_copy, monkeypatch, name, threat_timing):
+    monkeypatch.setattr(chesscellavg, "THREAT_TIMING", threat_timing)
+    pgn_path = bundled_copy(name)
+    assert analyze(store_of(pgn_path)) == analyze(pgn_path)
+
+
+def test_store_in_workers(analyze, bundled_copy):
+    pgn_path = bundled_copy('Levy.pgn')
+    assert analyze(store_of(pgn_path), workers=2) == analyze(pgn_path)
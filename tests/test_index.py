@@ -0,0 +1,48 @@
+import io
+import multiprocessing
+
+import chess.pgn
+
+from pgnio import build_index, load_index
+
+GAMES = '''[Event "Missing roster tags"]
+[White "Alice"]
+
+1. e4 e5 *
+
+[Event "Escaped name"]
+[White "A \\"quoted\\" name"]
+[Black "Bob"]
+[Date "2024.01.02"]
+[Result "1-0"]
+
+1. d4 d5 1-0
+'''
+
+
+def test_index_headers_match_python_chess(tmp_path):
+    pgn_path = tmp_path / 'games.pgn'
+    pgn_path.write_text(GAMES)
+    index = load_index(str(pgn_path))
+    try:
+        assert len(index) == 2
+        for n in range(len(index)):
+            headers = chess.pgn.read_game(io.StringIO(index.read_game(n))).headers
+            info = index[n]
+            assert (info.white, info.black, info.date, info.result) == (headers["White"], headers["Black"], headers["Date"], headers["Result"])
+    finally:
+        index.close()
+
+
+def test_parallel_build_matches_serial(tmp_path):
+    # Text before the first game, blank lines around the games and CRLF lines, cut into byte ranges that
+    # start and end anywhere in a line
+    pgn_path = tmp_path / 'games.pgn'
+    pgn_path.write_bytes(b'Text before the first game\n\n' + GAMES.encode() + b'\r\n\r\n' + GAMES.replace('\n', '\r\n').encode())
+    serial = io.BytesIO()
+    build_index(str(pgn_path), serial)
+    with multiprocessing.get_context('spawn').Pool(2) as pool:
+        for chunk_count in (1, 2, 3, 7, 50, 1000):
+            parallel = io.BytesIO()
+            build_index(str(pgn_path), parallel, pool, chunk_count)
+            assert parallel.getvalue() == serial.getvalue()
@@ -0,0 +1,53 @@
+import io
+import shutil
+
+import pytest
+
+import pgnfilter
+from conftest import REPO_DIR
+from pgnio import build_index, index_path_for
+
+
+def copy_levy(tmp_path, name, newline):
+    pgn_path = tmp_path / name
+    with open(f'{REPO_DIR}/Levy.pgn') as f, open(pgn_path, 'w', newline=newline) as out:
+        shutil.copyfileobj(f, out)
+    return str(pgn_path)
+
+
+def test_crlf_input_filters_like_lf(tmp_path):
+    lf_path = copy_levy(tmp_path, 'lf.pgn', '\n')
+    crlf_path = copy_levy(tmp_path, 'crlf.pgn', '\r\n')
+    games = pgnfilter.parse_and_filter_pgn(crlf_path, '', 'all', 'white')
+    assert games
+    assert games == pgnfilter.parse_and_filter_pgn(lf_path, '', 'all', 'white')
+    assert '\r' not in ''.join(games)
+
+
+def test_crlf_input_splits_like_lf(tmp_path):
+    lf_path = copy_levy(tmp_path, 'lf.pgn', '\n')
+    crlf_path = copy_levy(tmp_path, 'crlf.pgn', '\r\n')
+    counts = pgnfilter.split_and_filter_pgn(crlf_path, '', 'white', str(tmp_path / 'crlf'))
+    assert counts == pgnfilter.split_and_filter_pgn(lf_path, '', 'white', str(tmp_path / 'lf'))
+    for name in ('wins', 'losses', 'draws'):
+        with open(tmp_path / f'crlf_{name}.pgn', 'rb') as crlf, open(tmp_path / f'lf_{name}.pgn', 'rb') as lf:
+            assert crlf.read() == lf.read()
+
+
+def test_normalize_crlf_lines():
+    lines = ['[Event "a"]\r\n', '\r\n', '\r\n', '[White "b"]\r\n', '\r\n', '\r\n', '\r\n', '1. e4 *\r\n', '\r\n', '\r\n']
+    assert ''.join(pgnfilter.normalize_pgn_lines(lines)) == '[Event "a"]\r\n[White "b"]\r\n\r\n1. e4 *\r\n\r\n'
+    assert ''.join(pgnfilter.normalize_pgn_lines(line.replace('\r\n', '\n') for line in lines)) == '[Event "a"]\n[White "b"]\n\n1. e4 *\n\n'
+
+
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_workers_build_the_index_and_filter_like_serial(tmp_path, newline):
+    pgn_path = copy_levy(tmp_path, 'levy.pgn', newline)
+    serial_index = io.BytesIO()
+    build_index(pgn_path, serial_index)
+
+    # No index yet, the workers build it
+    games = pgnfilter.parse_and_filter_pgn(pgn_path, '', 'all', 'white', workers=2)
+    with open(index_path_for(pgn_path), 'rb') as f:
+        assert f.read() == serial_index.getvalue()
+    assert ''.join(games) == ''.join(pgnfilter.parse_and_filter_pgn(pgn_path, '', 'all', 'white'))
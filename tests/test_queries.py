@@ -0,0 +1,33 @@
+import json
+import os
+import subprocess
+import sys
+
+import chesscellavg
+from conftest import REPO_DIR
+
+
+def test_position_queries_must_be_starting_squares():
+    assert chesscellavg.query_positions(('position', 'e2')) == ['e2']
+    assert chesscellavg.query_positions(('position', 'H8')) == ['h8']
+    assert chesscellavg.query_positions(('position', 'e4')) == []
+    assert chesscellavg.query_positions(('position', 'z9')) == []
+
+
+def test_describe_positions():
+    assert chesscellavg.describe_positions(['a2', 'b2', 'c2', 'd2', 'e2', 'f2', 'g2', 'h2']) == ('P', 'white')
+    assert chesscellavg.describe_positions(['d8']) == ('Qd8', 'black')
+    assert chesscellavg.describe_positions([]) == (None, None)
+
+
+def test_batch_skips_unmatched_queries(tmp_path):
+    output = str(tmp_path / 'levy')
+    env = dict(os.environ, SDL_VIDEODRIVER='dummy')
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, 'chesscellavg.py'), '--pgnfile', 'Levy.pgn', '--no_cache', '--output', output,
+                    '--query', 'P white', '--query', 'e4', '--query', 'e7'], cwd=REPO_DIR, env=env, capture_output=True, check=True)
+
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.json')) == ['levy_P_white.json', 'levy_e7.json']
+    with open(output + '_e7.json') as f:
+        results = json.load(f)
+    assert (results["piece_type"], results["piece_color"], results["starting_positions"]) == ('Pe7', 'black', ['e7'])
+    assert results["squares"]["e7"]["positions"] > 0
@@ -0,0 +1,43 @@
+import chesscellavg
+from conftest import REPO_DIR
+
+
+def levy_games():
+    return list(chesscellavg.parse_pgn(f'{REPO_DIR}/Levy.pgn'))
+
+
+def write_games(pgn_path, games, mode='w'):
+    with open(pgn_path, mode) as f:
+        f.write(''.join(game + '\n\n' for game in games))
+
+
+def cache_settings(tmp_path):
+    return {"no_cache": False, "cache_dir": str(tmp_path / 'cache'), "cache_size": 64}
+
+
+def test_appended_games_resume(tmp_path, analyze, capsys):
+    games = levy_games()
+    pgn_path = tmp_path / 'games.pgn'
+    write_games(pgn_path, games[:10])
+    assert analyze(pgn_path, **cache_settings(tmp_path)) == analyze(pgn_path)
+
+    write_games(pgn_path, games[10:], 'a')
+    capsys.readouterr()
+    resumed = analyze(pgn_path, **cache_settings(tmp_path))
+    assert f"has {len(games) - 10} new games" in capsys.readouterr().out
+    assert resumed == analyze(pgn_path)
+
+
+def test_changed_file_is_analyzed_again(tmp_path, analyze, capsys):
+    games = levy_games()
+    pgn_path = tmp_path / 'games.pgn'
+    write_games(pgn_path, games)
+    analyze(pgn_path, **cache_settings(tmp_path))
+
+    # Cut short, then rewritten with the same length
+    for changed in (games[:8], games[::-1]):
+        write_games(pgn_path, changed)
+        capsys.readouterr()
+        result = analyze(pgn_path, **cache_settings(tmp_path))
+        assert "analyzing all of it again" in capsys.readouterr().out
+        assert result == analyze(pgn_path)
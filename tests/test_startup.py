@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+import pytest
+
+from conftest import REPO_DIR
+
+# Time --help may take on top of starting a bare interpreter. Today that is ~50-70 ms, importing python-chess
+# alone adds ~150 ms and pygame ~250 ms, so either of them coming back goes over it.
+STARTUP_BUDGET_SECONDS = 0.15
+# Best of a few runs, so one slow run on a busy machine doesn't fail the test
+STARTUP_RUNS = 3
+
+# Runs a script's --help in a fresh interpreter and reports which of the slow modules it imported
+PROBE = """
+import json, runpy, sys
+sys.argv = [sys.argv[1], '--help']
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+print(json.dumps({name: name in sys.modules for name in ('pygame', 'chess')}))
+"""
+
+
+@pytest.mark.parametrize('script', ['pgnfilter.py', 'chesscellavg.py'])
+def test_help_skips_pygame_and_chess(script):
+    result = subprocess.run([sys.executable, '-c', PROBE, os.path.join(REPO_DIR, script)],
+                            capture_output=True, text=True, cwd=REPO_DIR, check=True)
+    imported = json.loads(result.stdout.strip().splitlines()[-1])
+    assert imported == {'pygame': False, 'chess': False}
+
+
+def startup_seconds(args):
+    best = None
+    for _ in range(STARTUP_RUNS):
+        start = perf_counter()
+        subprocess.run([sys.executable] + args, capture_output=True, cwd=REPO_DIR, check=True)
+        elapsed = perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@pytest.mark.parametrize('script', ['pgnfilter.py', 'chesscellavg.py'])
+def test_help_startup_time(script):
+    bare = startup_seconds(['-c', 'pass'])
+    assert startup_seconds([os.path.join(REPO_DIR, script), '--help']) - bare < STARTUP_BUDGET_SECONDS
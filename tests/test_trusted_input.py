@@ -0,0 +1,19 @@
+import pytest
+
+import chesscellavg
+from conftest import REPO_DIR
+
+NULL_MOVE_GAME = '[Event "Null move"]\n\n1. e4 -- 2. d4 *\n'
+
+
+@pytest.mark.parametrize('trusted_input', [False, True])
+def test_null_move_drops_the_game(analyze, monkeypatch, trusted_input):
+    monkeypatch.setattr(chesscellavg, "TRUSTED_INPUT", trusted_input)
+    assert analyze([NULL_MOVE_GAME])[1] == 0
+
+
+def test_trusted_matches_checked(analyze, monkeypatch):
+    games = list(chesscellavg.parse_pgn(f'{REPO_DIR}/Levy.pgn')) + [NULL_MOVE_GAME]
+    checked = analyze(games)
+    monkeypatch.setattr(chesscellavg, "TRUSTED_INPUT", True)
+    assert analyze(games) == checked
@@ -0,0 +1,5 @@
+def test_workers_match_serial(analyze, bundled_copy):
+    pgn_path = bundled_copy('Levy.pgn')
+    serial = analyze(pgn_path)
+    assert serial[1] > 0
+    assert analyze(pgn_path, workers=2) == serial